@@ -0,0 +1,124 @@
+"""
+DBPool benchmarki: har bir soʻrovda aiosqlite.connect ochish va doimiy pul orqali ishlash,
+bir vaqtda ishlayotgan foydalanuvchilar sonini taqlid qilib callback/s oʻlchanadi.
+
+    python bench/db_pool.py --users 50 --callbacks 40
+
+Bitta callback match_ tugmasidagi DB ishi (tahlil + obuna holati parallel), har 5-chisida
+balans profili va har 10-chisida obuna yozuvi.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+MATCHES = 200
+
+
+async def seed(users: int):
+    async with bot.db_pool.writer() as db:
+        await db.executemany("INSERT INTO users (user_id, balance) VALUES (?, ?)", [(u, u * 100) for u in range(users)])
+        await db.executemany("INSERT INTO match_analyses (match_id, analysis, added_by) VALUES (?, ?, 1)",
+                             [(m, f"Tahlil {m} " * 20) for m in range(MATCHES)])
+        await db.executemany("""INSERT INTO subscriptions (user_id, match_id, match_time, home_team, away_team, league_code)
+            VALUES (?, ?, '2030-01-01T18:00:00Z', 'A', 'B', 'PL')""", [(u, m) for u in range(users) for m in range(0, MATCHES, 7)])
+        await db.commit()
+
+
+# ---------- Avvalgi holat: har bir soʻrov uchun yangi ulanish ----------
+async def connect_get_analysis(match_id: int):
+    async with aiosqlite.connect(bot.DB_PATH) as db:
+        async with db.execute("SELECT analysis, analysis_url, added_at FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
+            return await cur.fetchone()
+
+
+async def connect_is_subscribed(user_id: int, match_id: int):
+    async with aiosqlite.connect(bot.DB_PATH) as db:
+        async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (user_id, match_id)) as cur:
+            return await cur.fetchone() is not None
+
+
+async def connect_get_profile(user_id: int):
+    async with aiosqlite.connect(bot.DB_PATH) as db:
+        async with db.execute("SELECT balance, referral_count, referral_bonus_total FROM users WHERE user_id = ?", (user_id,)) as cur:
+            return await cur.fetchone()
+
+
+async def connect_subscribe(user_id: int, match_id: int):
+    async with aiosqlite.connect(bot.DB_PATH) as db:
+        await db.execute("""INSERT OR REPLACE INTO subscriptions
+            (user_id, match_id, match_time, home_team, away_team, league_code, notified_1h, notified_15m, notified_lineups)
+            VALUES (?, ?, '2030-01-01T18:00:00Z', 'A', 'B', 'PL', 0, 0, 0)""", (user_id, match_id))
+        await db.commit()
+
+
+async def connect_callback(user_id: int, i: int):
+    match_id = (user_id * 31 + i) % MATCHES
+    await asyncio.gather(connect_get_analysis(match_id), connect_is_subscribed(user_id, match_id))
+    if i % 5 == 0:
+        await connect_get_profile(user_id)
+    if i % 10 == 0:
+        await connect_subscribe(user_id, match_id)
+
+
+# ---------- DBPool: bot.py dagi haqiqiy helperlar ----------
+async def pool_subscribe(user_id: int, match_id: int):
+    async with bot.db_pool.writer() as db:
+        await db.execute("""INSERT OR REPLACE INTO subscriptions
+            (user_id, match_id, match_time, home_team, away_team, league_code, notified_1h, notified_15m, notified_lineups)
+            VALUES (?, ?, '2030-01-01T18:00:00Z', 'A', 'B', 'PL', 0, 0, 0)""", (user_id, match_id))
+        await db.commit()
+
+
+async def pool_callback(user_id: int, i: int):
+    match_id = (user_id * 31 + i) % MATCHES
+    await asyncio.gather(bot.get_analysis(match_id), bot.is_subscribed(user_id, match_id))
+    if i % 5 == 0:
+        await bot.get_user_profile(user_id)
+    if i % 10 == 0:
+        # subscribe_user notification_queue ga ham yozadi – benchmarkda faqat DB qismi
+        await pool_subscribe(user_id, match_id)
+
+
+async def run(callback, users: int, callbacks: int) -> float:
+    async def user(user_id: int):
+        for i in range(callbacks):
+            await callback(user_id, i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(users)))
+    return users * callbacks / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="bir vaqtdagi foydalanuvchilar")
+    parser.add_argument("--callbacks", type=int, default=40, help="har bir foydalanuvchi bosishlari")
+    args = parser.parse_args()
+
+    bot.logger.setLevel("WARNING")
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, "bench.db")
+        await bot.init_db()
+        try:
+            await seed(args.users)
+            await run(pool_callback, args.users, 2)  # qizdirish
+            per_call = await run(connect_callback, args.users, args.callbacks)
+            pooled = await run(pool_callback, args.users, args.callbacks)
+        finally:
+            await bot.close_db()
+    print(f"{args.users} foydalanuvchi x {args.callbacks} callback")
+    print(f"  {'aiosqlite.connect har soʻrovda':<32}{per_call:8.0f} callback/s")
+    print(f"  {f'DBPool ({bot.DB_READERS} oʻquvchi)':<32}{pooled:8.0f} callback/s  (x{pooled / per_call:.1f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Inline klaviaturalar mikrobenchmarki: bitta callback uchun klaviatura qurish CPU narxi,
+har safar qayta qurish (avvalgi holat) va oldindan qurilgan/memoizatsiya qilingan shablonlar.
+
+    python bench/keyboards.py --fixtures 20 --iterations 20000
+
+Bitta "callback" = ligalar menyusi + liga oʻyinlari roʻyxati + oʻyin tafsilotlari klaviaturasi.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from bot import InlineKeyboardButton, InlineKeyboardMarkup, TOP_LEAGUES  # noqa: E402
+
+
+# ---------- Avvalgi holat: har bir callback da hammasi qaytadan quriladi ----------
+def legacy_money_row():
+    return [InlineKeyboardButton("💰 Pul ishlash", callback_data="money_info"),
+            InlineKeyboardButton("💳 Balans", callback_data="balance_info"),
+            InlineKeyboardButton("💸 Pul yechish", callback_data="withdraw_info")]
+
+
+def legacy_leagues_keyboard():
+    kb = []
+    for code, data in TOP_LEAGUES.items():
+        kb.append([InlineKeyboardButton(data["name"], callback_data=f"league_{code}")])
+    kb.append(legacy_money_row())
+    return InlineKeyboardMarkup(kb)
+
+
+def legacy_matches_keyboard(matches):
+    kb = []
+    for m in matches[:10]:
+        date_obj = datetime.strptime(m["utcDate"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
+        date_str = date_obj.strftime("%d.%m %H:%M")
+        kb.append([InlineKeyboardButton(f"{m['homeTeam']['name']} – {m['awayTeam']['name']} ({date_str})", callback_data=f"match_{m['id']}")])
+    kb.append([InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues")])
+    kb.append(legacy_money_row())
+    return InlineKeyboardMarkup(kb)
+
+
+def legacy_match_detail_keyboard(mid, is_subscribed=False, lineups_available=False, analysis_url=None):
+    kb = []
+    if is_subscribed:
+        kb.append([InlineKeyboardButton("🔕 Kuzatishni bekor qilish", callback_data=f"unsubscribe_{mid}")])
+    else:
+        kb.append([InlineKeyboardButton("🔔 Kuzatish", callback_data=f"subscribe_{mid}")])
+    if analysis_url:
+        kb.append([InlineKeyboardButton("🔗 To‘liq tahlil", url=analysis_url)])
+    kb.append([InlineKeyboardButton("📰 Futbol yangiliklari", url="https://t.me/ai_futinside"),
+               InlineKeyboardButton("📊 Chuqur tahlil", url="https://futbolinside.netlify.app/"),
+               InlineKeyboardButton("🎲 Stavka qilish", url="https://superlative-twilight-47ef34.netlify.app/")])
+    if lineups_available:
+        kb.append([InlineKeyboardButton("📋 Tarkiblarni ko‘rish", callback_data=f"lineups_{mid}")])
+    kb.append([InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues")])
+    kb.append(legacy_money_row())
+    return InlineKeyboardMarkup(kb)
+
+
+def fixtures(count: int):
+    start = datetime(2030, 1, 1, 18, 0)
+    return [{"id": 500000 + i, "utcDate": (start + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+             "homeTeam": {"name": f"Home FC {i}"}, "awayTeam": {"name": f"Away United {i}"}}
+            for i in range(count)]
+
+
+def per_call_us(fn, iterations: int) -> float:
+    started = time.process_time()
+    for i in range(iterations):
+        fn(i)
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", type=int, default=20, help="liga roʻyxatidagi oʻyinlar")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--matches", type=int, default=50, help="tafsilot koʻrilayotgan turli oʻyinlar")
+    args = parser.parse_args()
+
+    matches = fixtures(args.fixtures)
+    # Yangi holatda liga klaviaturasi maʼlumot saqlanganda bir marta quriladi (store_league/load_league)
+    league_entry = {"matches": matches, "keyboard": bot.build_matches_keyboard(matches)}
+
+    def legacy(i):
+        mid = matches[i % args.matches % len(matches)]["id"]
+        legacy_leagues_keyboard()
+        legacy_matches_keyboard(matches)
+        legacy_match_detail_keyboard(mid, i % 2 == 0, True, None)
+
+    def templated(i):
+        mid = matches[i % args.matches % len(matches)]["id"]
+        bot.LEAGUES_KEYBOARD
+        league_entry["keyboard"]
+        bot.build_match_detail_keyboard(mid, i % 2 == 0, True, None)
+
+    rows = [
+        ("callback: avvalgi", per_call_us(legacy, args.iterations)),
+        ("callback: shablonlar", per_call_us(templated, args.iterations)),
+        ("liga roʻyxati: qayta qurish", per_call_us(lambda i: legacy_matches_keyboard(matches), args.iterations)),
+        ("liga roʻyxati: saqlashda qurish", per_call_us(lambda i: bot.build_matches_keyboard(matches), args.iterations)),
+        ("tafsilot: avvalgi", per_call_us(lambda i: legacy_match_detail_keyboard(i % args.matches, True, True, None),
+                                          args.iterations)),
+        ("tafsilot: lru_cache", per_call_us(lambda i: bot.build_match_detail_keyboard(i % args.matches, True, True, None),
+                                            args.iterations)),
+    ]
+    print(f"{args.fixtures} ta oʻyin, {args.iterations} iteratsiya (CPU vaqti)")
+    for label, us in rows:
+        print(f"  {label:<34}{us:10.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,33 @@
 import os
 import asyncio
 import logging
+import json
 import aiohttp
 import aiosqlite
 import random
 import time
+import heapq
+import bisect
+import itertools
+import functools
+import hmac
+import hashlib
+import secrets
+import socket
 from datetime import datetime, timedelta, date
 from aiohttp import web
 from urllib.parse import quote
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from telegram.helpers import escape_markdown
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # faqat STATE_BACKEND_URL=redis://... boʻlganda kerak
+    aioredis = None
 
 # ---------- SOZLAMALAR ----------
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -31,7 +47,15 @@ TOP_LEAGUES = {
 }
 
 DAYS_AHEAD = 7
-DB_PATH = "data/bot.db"
+LINEUPS_WINDOW = 75
+DB_PATH = os.environ.get("DB_PATH", "data/bot.db")
+
+# ========== BOT ==========
+# run_bot ichida bir marta aniqlanadi (getMe), keyin tarmoqsiz ishlatiladi
+BOT_USERNAME = os.environ.get("BOT_USERNAME")
+
+# ========== ADMINLAR ==========
+MAIN_ADMINS = frozenset(int(x) for x in os.environ.get("MAIN_ADMINS", "6935090105").split(",") if x.strip())
 
 # ========== REFERRAL & BONUS ==========
 REFERRAL_BONUS = 2000
@@ -39,213 +63,1105 @@ MIN_WITHDRAW = 50000
 MAX_WITHDRAW_DAILY = 1
 AISPORTS_BONUS = 30000
 
-# ========== API RATE LIMIT ==========
-API_SEMAPHORE = asyncio.Semaphore(1)
-API_LAST_CALL = 0
-API_MIN_INTERVAL = 6
-
-async def rate_limited_api_call(url, headers, params=None):
-    global API_LAST_CALL
-    async with API_SEMAPHORE:
-        now = time.time()
-        if now - API_LAST_CALL < API_MIN_INTERVAL:
-            await asyncio.sleep(API_MIN_INTERVAL - (now - API_LAST_CALL))
-        for attempt in range(3):
+# ========== METRICS ==========
+# Prometheus matn formati; hot path da faqat lugʻat yangilanadi, formatlash /metrics soʻralganda
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        return _HistogramTimer(self, labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+class _HistogramTimer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class MetricsRegistry:
+    """Metrikalar va mavjud statistikani (kesh, limiter, ...) soʻrov paytida oʻqiydigan gauge collectorlar."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, doc: str, labelnames=()):
+        metric = Counter(name, doc, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, doc: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, doc, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """fn() -> [(name, type, doc, [(labels_dict, value), ...]), ...]"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers, params=params) as resp:
-                        API_LAST_CALL = time.time()
-                        if resp.status == 200:
-                            return {"success": await resp.json()}
-                        elif resp.status == 429:
-                            await asyncio.sleep(2 ** attempt + random.uniform(1, 3))
-                        else:
-                            return {"error": f"❌ API xatolik: {resp.status}"}
+                families = fn()
             except Exception as e:
-                logger.error(f"API call xatosi (urinish {attempt+1}): {e}")
-                await asyncio.sleep(2 ** attempt)
-        return {"error": "❌ API ga bogʻlanib boʻlmadi"}
+                logger.error(f"Metrika collector xatosi ({fn.__name__}): {e}")
+                continue
+            for name, kind, doc, samples in families:
+                lines.append(f"# HELP {name} {doc}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+API_REQUEST_SECONDS = metrics.histogram("footbot_api_request_seconds", "football-data.org javob sarlavhalarigacha vaqt",
+                                        ("endpoint", "status"))
+API_QUEUE_WAIT_SECONDS = metrics.histogram("footbot_api_queue_wait_seconds", "API rate-limit navbatida kutish",
+                                           ("priority",))
+API_CALLS = metrics.counter("footbot_api_calls_total", "rate_limited_api_call chaqiruvlari", ("endpoint", "result"))
+DB_QUERY_SECONDS = metrics.histogram("footbot_db_query_seconds", "DB helper davomiyligi", ("query",))
+DB_ERRORS = metrics.counter("footbot_db_errors_total", "DB helper xatolari", ("query",))
+CALLBACK_SECONDS = metrics.histogram("footbot_callback_seconds", "button_callback davomiyligi", ("action",))
+CALLBACK_ERRORS = metrics.counter("footbot_callback_errors_total", "button_callback xatolari", ("action",))
+SCHEDULER_TICKS = metrics.counter("footbot_scheduler_ticks_total", "Scheduler ishga tushgan hodisalar", ("kind",))
+NOTIFICATION_SECONDS = metrics.histogram("footbot_notification_seconds", "Bitta bildirishnoma hodisasini yuborish",
+                                         ("kind",), buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900))
+BROADCAST_MESSAGES = metrics.counter("footbot_broadcast_messages_total", "Broadcast natijalari", ("result",))
+
+def observe_db(fn):
+    """DB helper dekoratori: davomiylik va xatolarni funksiya nomi bilan yozadi."""
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+# ========== HTTP SESSION ==========
+HTTP_TOTAL_TIMEOUT = float(os.environ.get("HTTP_TOTAL_TIMEOUT", 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", 10))
+HTTP_KEEPALIVE = float(os.environ.get("HTTP_KEEPALIVE", 60))
+
+http_session: aiohttp.ClientSession = None
+
+async def start_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, keepalive_timeout=HTTP_KEEPALIVE,
+                                         ttl_dns_cache=300, enable_cleanup_closed=True)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        http_session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={"Accept-Encoding": "gzip, deflate"})
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
+
+# ========== API RATE LIMIT ==========
+API_REQUESTS_PER_MINUTE = int(os.environ.get("API_REQUESTS_PER_MINUTE", 10))
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+class TokenBucket:
+    """Token-bucket cheklovchi: kutayotganlar ustuvorlik (lane) tartibida token oladi."""
+
+    def __init__(self, rate: float, per: float = 60.0, capacity: float = None):
+        self.rate = rate / per
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._drainer = None
+        self._lanes = {}
+
+    def _lane(self, priority):
+        lane = self._lanes.get(priority)
+        if lane is None:
+            lane = self._lanes[priority] = {"waiting": 0, "granted": 0, "wait_total": 0.0, "wait_max": 0.0}
+        return lane
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._paused_until:
+            if now < self._paused_until:
+                self._updated = now
+                return
+            # Server hisoblagichi yangilandi – toʻliq kvota qaytadi
+            self._paused_until = 0.0
+            self.tokens = self.capacity
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _grant(self, priority, enqueued):
+        self.tokens -= 1
+        waited = time.monotonic() - enqueued
+        lane = self._lane(priority)
+        lane["granted"] += 1
+        lane["wait_total"] += waited
+        lane["wait_max"] = max(lane["wait_max"], waited)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, ticket: "PriorityTicket" = None):
+        """ticket berilsa ustuvorlik undan olinadi va kutish paytida ticket.raise_to() bilan koʻtarilishi mumkin."""
+        if ticket is not None:
+            priority = ticket.priority
+        enqueued = time.monotonic()
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self._grant(priority, enqueued)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), enqueued, fut]
+        heapq.heappush(self._waiters, entry)
+        self._lane(priority)["waiting"] += 1
+        if ticket is not None:
+            ticket._waiting = (self, entry)
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        try:
+            await fut
+        finally:
+            if ticket is not None:
+                ticket._waiting = None
+            self._lane(entry[0])["waiting"] -= 1
+
+    def reprioritize(self, entry, priority: int):
+        """Navbatdagi yozuvni boshqa lane ga oʻtkazadi; lane ichidagi tartib (seq) saqlanadi."""
+        if entry[3].done() or entry[0] == priority:
+            return
+        self._lane(entry[0])["waiting"] -= 1
+        self._lane(priority)["waiting"] += 1
+        entry[0] = priority
+        heapq.heapify(self._waiters)
+
+    async def _drain(self):
+        while self._waiters:
+            self._refill()
+            if self.tokens >= 1:
+                priority, _, enqueued, fut = heapq.heappop(self._waiters)
+                if not fut.done():
+                    self._grant(priority, enqueued)
+                    fut.set_result(None)
+                continue
+            delay = max(self._paused_until - time.monotonic(), (1 - self.tokens) / self.rate)
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        self._refill()
+        self.tokens = 0
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def sync(self, available: int = None, reset_in: float = None):
+        """Server qaytargan qolgan kvota bilan mahalliy hisobni moslashtiradi."""
+        self._refill()
+        if available is None:
+            return
+        self.tokens = min(self.tokens, available)
+        if available <= 0 and reset_in:
+            self.pause(reset_in)
+
+    def snapshot(self):
+        lanes = {}
+        for priority, lane in sorted(self._lanes.items()):
+            granted = lane["granted"]
+            lanes[PRIORITY_NAMES.get(priority, str(priority))] = {
+                "queue_depth": lane["waiting"],
+                "granted": granted,
+                "wait_avg": lane["wait_total"] / granted if granted else 0.0,
+                "wait_max": lane["wait_max"],
+            }
+        return {"tokens": round(self.tokens, 2), "lanes": lanes}
+
+api_limiter = TokenBucket(API_REQUESTS_PER_MINUTE)
+
+def _header_number(headers, name):
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+# ========== SINGLE-FLIGHT ==========
+class PriorityTicket:
+    """Umumiy soʻrovning joriy ustuvorligi; token kutilayotganda limiter navbatidagi oʻrni bilan bogʻlanadi."""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self._waiting = None  # (TokenBucket, navbat yozuvi)
+
+    def raise_to(self, priority: int) -> bool:
+        if priority >= self.priority:
+            return False
+        self.priority = priority
+        if self._waiting is not None:
+            bucket, entry = self._waiting
+            bucket.reprioritize(entry, priority)
+        return True
+
+class SingleFlight:
+    """
+    Bir xil kalitli parallel chaqiruvlarni bitta umumiy soʻrovga birlashtiradi.
+    priority berilsa factory(ticket) chaqiriladi: yuqoriroq ustuvorlikdagi kuzatuvchi qoʻshilsa,
+    umumiy soʻrov fon navbatida qolib ketmasdan uning lane iga koʻtariladi.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.stats = {"leaders": 0, "followers": 0, "promoted": 0}
+
+    async def do(self, key, factory, priority: int = None):
+        flight = self._inflight.get(key)
+        if flight is None:
+            ticket = PriorityTicket(priority) if priority is not None else None
+            task = asyncio.create_task(factory(ticket) if ticket is not None else factory())
+            self._inflight[key] = (task, ticket)
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key, (None,))[0] is t else None)
+            self.stats["leaders"] += 1
+        else:
+            task, ticket = flight
+            self.stats["followers"] += 1
+            if ticket is not None and priority is not None and ticket.raise_to(priority):
+                self.stats["promoted"] += 1
+        # shield: bitta chaqiruvchi bekor qilinsa ham umumiy soʻrov davom etadi
+        return await asyncio.shield(task)
+
+api_flight = SingleFlight()
+
+def _api_endpoint(url: str) -> str:
+    """Metrika label: /matches -> matches, /matches/123 -> match (kardinallik cheklanadi)."""
+    parts = url[len(FOOTBALL_DATA_URL):].strip("/").split("/")
+    return "match" if len(parts) > 1 and parts[0] == "matches" else parts[0]
+
+async def rate_limited_api_call(url, headers, params=None, priority=PRIORITY_INTERACTIVE, etag=None):
+    key = (url, tuple(sorted((params or {}).items())), etag)
+    result = await api_flight.do(key, lambda ticket: _api_call(url, headers, params, ticket, etag), priority)
+    API_CALLS.inc(_api_endpoint(url), "success" if "success" in result else "not_modified" if "not_modified" in result else "error")
+    return result
+
+async def _api_call(url, headers, params, ticket: PriorityTicket, etag=None):
+    session = await start_http_session()
+    if etag:
+        headers = {**headers, "If-None-Match": etag}
+    endpoint = _api_endpoint(url)
+    for attempt in range(3):
+        with API_QUEUE_WAIT_SECONDS.time(PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))):
+            await api_limiter.acquire(ticket=ticket)
+            await state_backend.acquire_token("football-data", API_REQUESTS_PER_MINUTE, 60)
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers, params=params) as resp:
+                API_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, resp.status)
+                available = _header_number(resp.headers, "X-Requests-Available-Minute")
+                reset_in = _header_number(resp.headers, "X-RequestCounter-Reset")
+                api_limiter.sync(available, reset_in)
+                if resp.status == 200:
+                    return {"success": await resp.json(), "etag": resp.headers.get("ETag")}
+                elif resp.status == 304:
+                    return {"not_modified": True, "etag": etag}
+                elif resp.status == 429:
+                    pause = reset_in or 2 ** attempt + random.uniform(1, 3)
+                    api_limiter.pause(pause)
+                    await state_backend.pause_tokens("football-data", pause)
+                else:
+                    return {"error": f"❌ API xatolik: {resp.status}"}
+        except Exception as e:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, "exception")
+            logger.error(f"API call xatosi (urinish {attempt+1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+    return {"error": "❌ API ga bogʻlanib boʻlmadi"}
 
-# ========== MATCH CACHE (10 daqiqa) ==========
-match_cache = OrderedDict()
+# ========== MATCH CACHE ==========
 CACHE_TTL = 600
+MATCH_CACHE_MAX_ENTRIES = int(os.environ.get("MATCH_CACHE_MAX_ENTRIES", 2000))
+MATCH_CACHE_MAX_BYTES = int(os.environ.get("MATCH_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = 60
+LIVE_STATUSES = {"LIVE", "IN_PLAY", "PAUSED"}
+MATCH_TTL_BY_STATUS = {
+    "FINISHED": 6 * 3600,
+    "AWARDED": 6 * 3600,
+    "CANCELLED": 6 * 3600,
+    "POSTPONED": 3600,
+    "SUSPENDED": 300,
+    "LIVE": 20,
+    "IN_PLAY": 20,
+    "PAUSED": 60,
+}
 
-async def get_cached_match(match_id: int):
-    now = time.time()
-    if match_id in match_cache:
-        data, ts = match_cache[match_id]
-        if now - ts < CACHE_TTL:
-            return data
-        del match_cache[match_id]
+class LRUCache:
+    """Yozuvlar soni va taxminiy hajmi cheklangan, TTL li LRU kesh."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, count: bool = True):
+        item = self._data.get(key)
+        if item is not None and item[1] <= time.monotonic():
+            self._remove(key)
+            self.stats["expired"] += 1
+            item = None
+        if item is None:
+            if count:
+                self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(key)
+        if count:
+            self.stats["hits"] += 1
+        return item[0]
+
+    def set(self, key, value, ttl: float, size: int = None):
+        if size is None:
+            size = len(json.dumps(value, separators=(",", ":"), default=str))
+        if key in self._data:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self.bytes += size
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.stats["evicted"] += 1
+
+    def pop(self, key):
+        if key in self._data:
+            self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        expired = [k for k, (_, expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.stats["expired"] += len(expired)
+        return len(expired)
+
+    def snapshot(self):
+        return {"entries": len(self._data), "bytes": self.bytes, **self.stats}
+
+match_cache = LRUCache(MATCH_CACHE_MAX_ENTRIES, MATCH_CACHE_MAX_BYTES)
+
+def match_ttl(match) -> int:
+    return MATCH_TTL_BY_STATUS.get(match.get("status"), CACHE_TTL)
+
+def has_full_details(match) -> bool:
+    """Roʻyxat (/matches) yozuvlarida tarkib yoʻq – faqat /matches/{id} javobi toʻliq."""
+    return "lineup" in match.get("homeTeam", {})
+
+async def get_cached_match(match_id: int, priority: int = PRIORITY_INTERACTIVE, full: bool = False):
+    data = match_cache.get(match_id)
+    if data is not None and (not full or has_full_details(data)):
+        return data
+    key = f"match:{match_id}"
+    stored = await state_backend.cache_get(key)
+    if stored and stored["expires_at"] > time.time() and (not full or has_full_details(stored["payload"])):
+        match_cache.set(match_id, stored["payload"], stored["expires_at"] - time.time())
+        return stored["payload"]
     url = f"{FOOTBALL_DATA_URL}/matches/{match_id}"
-    headers = {"X-Auth-Token": FOOTBALL_DATA_KEY}
-    result = await rate_limited_api_call(url, headers)
-    if "success" in result:
-        match_cache[match_id] = (result["success"], now)
-        return result["success"]
-    return None
+    result = await rate_limited_api_call(url, HEADERS, priority=priority, etag=stored and stored["etag"])
+    if "not_modified" in result:
+        data = stored["payload"]
+    elif "success" in result:
+        data = result["success"]
+    else:
+        # API ishlamasa eskirgan nusxa hech narsadan yaxshi
+        return stored["payload"] if stored else None
+    ttl = match_ttl(data)
+    match_cache.set(match_id, data, ttl)
+    await state_backend.cache_set(key, data, ttl, result.get("etag"))
+    return data
+
+async def cache_sweeper():
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            removed = match_cache.sweep()
+            if removed:
+                logger.info(f"Match keshi tozalandi: {removed} ta yozuv, holat: {match_cache.snapshot()}")
+            await state_backend.cache_purge()
+        except Exception as e:
+            logger.exception(f"Kesh tozalash xatosi: {e}")
+
+# ========== LEAGUE CACHE ==========
+LEAGUE_CACHE_TTL = int(os.environ.get("LEAGUE_CACHE_TTL", 900))
+LEAGUE_CACHE_LIVE_TTL = int(os.environ.get("LEAGUE_CACHE_LIVE_TTL", 60))
+LEAGUE_CACHE_MAX_STALE = int(os.environ.get("LEAGUE_CACHE_MAX_STALE", 6 * 3600))
+
+league_cache = {}
+league_cache_stats = {"hit": 0, "stale": 0, "miss": 0}
+_league_refreshing = set()
+
+def league_ttl(matches) -> int:
+    """Jonli yoki tez orada boshlanadigan oʻyin boʻlsa qisqa TTL qaytaradi."""
+    soon = (datetime.utcnow() + timedelta(seconds=LEAGUE_CACHE_TTL)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for m in matches:
+        if m.get("status") in LIVE_STATUSES:
+            return LEAGUE_CACHE_LIVE_TTL
+        if m.get("status") in ("SCHEDULED", "TIMED") and m.get("utcDate", "") <= soon:
+            return LEAGUE_CACHE_LIVE_TTL
+    return LEAGUE_CACHE_TTL
+
+async def store_league(league_code: str, matches, date_from: str, etag: str = None, ttl: int = None):
+    ttl = ttl or league_ttl(matches)
+    entry = league_cache[league_code] = {"matches": matches, "date_from": date_from, "etag": etag,
+                                         "expires_at": time.time() + ttl, "keyboard": build_matches_keyboard(matches)}
+    await state_backend.cache_set(f"league:{league_code}:{date_from}", matches, ttl, etag)
+    return entry
+
+async def load_league(league_code: str, date_from: str):
+    entry = league_cache.get(league_code)
+    if entry and entry["date_from"] != date_from:
+        entry = None
+    if entry and entry["expires_at"] > time.time():
+        return entry
+    # Eskirgan boʻlsa umumiy keshni tekshiramiz – boshqa worker allaqachon yangilagan boʻlishi mumkin
+    stored = await state_backend.cache_get(f"league:{league_code}:{date_from}")
+    if not stored or (entry and stored["expires_at"] <= entry["expires_at"]):
+        return entry
+    entry = league_cache[league_code] = {"matches": stored["payload"], "date_from": date_from,
+                                         "etag": stored["etag"], "expires_at": stored["expires_at"],
+                                         "keyboard": build_matches_keyboard(stored["payload"])}
+    return entry
+
+# ========== FIXTURE PREFETCH ==========
+PREFETCH_INTERVAL = LEAGUE_CACHE_TTL
+PREFETCH_INTERVAL_LIVE = LEAGUE_CACHE_LIVE_TTL
+PREFETCH_INTERVAL_NEAR = 300
+PREFETCH_INTERVAL_IDLE = 3600
+PREFETCH_NEAR_WINDOW = 2 * 3600
+PREFETCH_LEASE_RETRY = 60
+
+def prefetch_interval(matches) -> int:
+    """Eng yaqin boshlanish vaqtiga qarab keyingi yangilanishgacha kutish (soniya)."""
+    now = datetime.utcnow()
+    nearest = None
+    for m in matches:
+        if m.get("status") in LIVE_STATUSES:
+            return PREFETCH_INTERVAL_LIVE
+        if m.get("status") in ("SCHEDULED", "TIMED") and m.get("utcDate"):
+            kickoff = datetime.strptime(m["utcDate"], "%Y-%m-%dT%H:%M:%SZ")
+            if kickoff >= now and (nearest is None or kickoff < nearest):
+                nearest = kickoff
+    if nearest is None:
+        return PREFETCH_INTERVAL_IDLE
+    if (nearest - now).total_seconds() <= PREFETCH_NEAR_WINDOW:
+        return PREFETCH_INTERVAL_NEAR
+    return PREFETCH_INTERVAL
+
+async def prefetch_fixtures():
+    """Barcha TOP_LEAGUES oʻyinlarini bitta soʻrovda olib, liga va match keshlariga ajratadi."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    end_date = (datetime.now() + timedelta(days=DAYS_AHEAD)).strftime("%Y-%m-%d")
+    url = f"{FOOTBALL_DATA_URL}/matches"
+    params = {"competitions": ",".join(TOP_LEAGUES), "dateFrom": today, "dateTo": end_date,
+              "status": "SCHEDULED,LIVE,IN_PLAY,PAUSED,FINISHED"}
+    res = await rate_limited_api_call(url, HEADERS, params, PRIORITY_BACKGROUND)
+    if "success" not in res:
+        logger.warning(f"Oʻyinlarni oldindan yuklab boʻlmadi: {res.get('error')}")
+        return None
+    matches = res["success"].get("matches", [])
+    interval = prefetch_interval(matches)
+    by_league = {code: [] for code in TOP_LEAGUES}
+    for m in matches:
+        code = m.get("competition", {}).get("code")
+        if code in by_league:
+            by_league[code].append(m)
+    for code, league_matches in by_league.items():
+        ttl = league_ttl(league_matches)
+        await store_league(code, league_matches, today, ttl=max(ttl, interval + 60) if ttl == LEAGUE_CACHE_TTL else ttl)
+    for m in matches:
+        cached = match_cache.get(m["id"], count=False)
+        # Toʻliq (tarkibli) yozuvni qisqa roʻyxat yozuvi bilan almashtirmaymiz
+        if cached is None or not has_full_details(cached):
+            match_cache.set(m["id"], m, match_ttl(m))
+    await state_backend.cache_set_many([(f"match:{m['id']}", m) for m in matches], match_ttl)
+    logger.info(f"{len(matches)} ta oʻyin oldindan yuklandi, keyingi yangilanish {interval} s dan keyin")
+    return matches
+
+async def fixture_prefetcher():
+    """Faqat "prefetch" lease egasi API ga boradi; qolgan workerlar umumiy keshdan oʻqiydi."""
+    while True:
+        interval = PREFETCH_LEASE_RETRY
+        try:
+            if await state_backend.acquire_lease("prefetch", PREFETCH_INTERVAL_IDLE + PREFETCH_LEASE_RETRY):
+                matches = await prefetch_fixtures()
+                interval = prefetch_interval(matches) if matches is not None else PREFETCH_INTERVAL_NEAR
+                # Lease keyingi yangilanishgacha saqlanadi; worker oʻlsa muddati tugab boshqasiga oʻtadi
+                await state_backend.acquire_lease("prefetch", interval + PREFETCH_LEASE_RETRY)
+        except Exception as e:
+            logger.exception(f"Prefetch xatosi: {e}")
+            interval = PREFETCH_INTERVAL_NEAR
+        await asyncio.sleep(interval)
+
+# ========== DB POOL ==========
+DB_READERS = int(os.environ.get("DB_READERS", 4))
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+)
+
+class DBPool:
+    """Bitta yozuvchi va bir nechta oʻquvchi ulanishdan iborat doimiy SQLite puli."""
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._idle = asyncio.Queue()
+        self._conns = []
+
+    async def _connect(self, read_only=False):
+        conn = await aiosqlite.connect(self.path)
+        for pragma in DB_PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only=1")
+        self._conns.append(conn)
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        for _ in range(self.readers):
+            self._idle.put_nowait(await self._connect(read_only=True))
+
+    async def close(self):
+        for conn in self._conns:
+            await conn.close()
+        self._conns.clear()
+        self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
+
+db_pool: DBPool = None
+# Bazaning oʻz identifikatori (meta jadvalida): umumiy holatdagi bazaga bogʻliq kalitlar shu bilan ajratiladi
+DB_ID = None
+
+# ========== MIGRATIONS ==========
+async def _column_exists(db, table: str, column: str) -> bool:
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        return any(row[1] == column for row in await cur.fetchall())
+
+async def _migration_base_tables(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_by INTEGER, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    await db.execute("""CREATE TABLE IF NOT EXISTS match_analyses (
+        match_id INTEGER PRIMARY KEY, 
+        analysis TEXT NOT NULL DEFAULT 'Tahlil kutilmoqda', 
+        analysis_url TEXT,
+        added_by INTEGER NOT NULL, 
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS subscriptions (
+        user_id INTEGER, match_id INTEGER, match_time TIMESTAMP NOT NULL, home_team TEXT, away_team TEXT, league_code TEXT,
+        notified_1h BOOLEAN DEFAULT 0, notified_15m BOOLEAN DEFAULT 0, notified_lineups BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, match_id))""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY, balance INTEGER DEFAULT 0, referrer_id INTEGER,
+        referral_count INTEGER DEFAULT 0, daily_withdraw_date TEXT, aisports_bonus_received INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (referrer_id) REFERENCES users(user_id))""")
+    await db.execute("CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY AUTOINCREMENT, referrer_id INTEGER NOT NULL, referred_id INTEGER NOT NULL, bonus INTEGER DEFAULT 2000, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(referred_id))")
+    await db.execute("CREATE TABLE IF NOT EXISTS withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, amount INTEGER NOT NULL, status TEXT DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+
+async def _migration_legacy_columns(db):
+    # Eski bazalarda bu ustunlar keyinroq qoʻshilgan
+    if not await _column_exists(db, "match_analyses", "analysis_url"):
+        await db.execute("ALTER TABLE match_analyses ADD COLUMN analysis_url TEXT")
+    if not await _column_exists(db, "users", "aisports_bonus_received"):
+        await db.execute("ALTER TABLE users ADD COLUMN aisports_bonus_received INTEGER DEFAULT 0")
+
+async def _migration_api_cache(db):
+    await db.execute("""CREATE TABLE IF NOT EXISTS api_cache (
+        cache_key TEXT PRIMARY KEY, payload TEXT NOT NULL, etag TEXT,
+        fetched_at REAL NOT NULL, expires_at REAL NOT NULL)""")
+
+async def _migration_hot_query_indexes(db):
+    await db.execute("""CREATE INDEX IF NOT EXISTS idx_subscriptions_match
+        ON subscriptions(match_id, notified_1h, notified_15m, notified_lineups, user_id)""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_time ON subscriptions(match_time, match_id, notified_1h, notified_15m)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id, created_at, bonus)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status, amount)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_api_cache_expires ON api_cache(expires_at)")
+
+async def _migration_profile_counters(db):
+    await db.execute("ALTER TABLE users ADD COLUMN referral_bonus_total INTEGER DEFAULT 0")
+    await db.execute("ALTER TABLE users ADD COLUMN referrals_today INTEGER DEFAULT 0")
+    await db.execute("ALTER TABLE users ADD COLUMN referrals_today_date TEXT")
+    await db.execute("""UPDATE users SET
+        referral_bonus_total = (SELECT COALESCE(SUM(bonus), 0) FROM referrals WHERE referrer_id = users.user_id),
+        referrals_today = (SELECT COUNT(*) FROM referrals WHERE referrer_id = users.user_id
+            AND created_at >= DATE('now') AND created_at < DATE('now', '+1 day')),
+        referrals_today_date = DATE('now')""")
+
+async def _migration_jobs(db):
+    await db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, dedupe_key TEXT, payload TEXT NOT NULL,
+        run_at REAL NOT NULL, attempts INTEGER DEFAULT 0, locked_until REAL DEFAULT 0,
+        UNIQUE(kind, dedupe_key))""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at, locked_until)")
+
+async def _migration_live_messages(db):
+    await db.execute("""CREATE TABLE IF NOT EXISTS live_messages (
+        match_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL,
+        content_hash TEXT NOT NULL, updated_at REAL NOT NULL,
+        PRIMARY KEY (match_id, chat_id)) WITHOUT ROWID""")
+
+async def _migration_jobs_lock_in_run_at(db):
+    # Lock endi run_at ning oʻzida saqlanadi – MIN(run_at) indeks boshidan oʻqiladi
+    await db.execute("UPDATE jobs SET run_at = MAX(run_at, locked_until), locked_until = 0 WHERE locked_until > run_at")
+
+async def _migration_db_id(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    await db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('db_id', ?)", (secrets.token_hex(8),))
+
+MIGRATIONS = [
+    (1, "base_tables", _migration_base_tables),
+    (2, "legacy_columns", _migration_legacy_columns),
+    (3, "api_cache", _migration_api_cache),
+    (4, "hot_query_indexes", _migration_hot_query_indexes),
+    (5, "profile_counters", _migration_profile_counters),
+    (6, "jobs", _migration_jobs),
+    (7, "live_messages", _migration_live_messages),
+    (8, "jobs_lock_in_run_at", _migration_jobs_lock_in_run_at),
+    (9, "db_id", _migration_db_id),
+]
+
+async def run_migrations(db):
+    await db.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    await db.commit()
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cur:
+        current = (await cur.fetchone())[0]
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        await db.execute("BEGIN IMMEDIATE")
+        await step(db)
+        await db.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+        await db.commit()
+        logger.info(f"Migratsiya {version} ({name}) bajarildi")
 
 # ========== DATABASE ==========
 async def init_db():
+    global db_pool, DB_ID
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_by INTEGER, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-        await db.execute("""CREATE TABLE IF NOT EXISTS match_analyses (
-            match_id INTEGER PRIMARY KEY, 
-            analysis TEXT NOT NULL DEFAULT 'Tahlil kutilmoqda', 
-            analysis_url TEXT,
-            added_by INTEGER NOT NULL, 
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS subscriptions (
-            user_id INTEGER, match_id INTEGER, match_time TIMESTAMP NOT NULL, home_team TEXT, away_team TEXT, league_code TEXT,
-            notified_1h BOOLEAN DEFAULT 0, notified_15m BOOLEAN DEFAULT 0, notified_lineups BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, match_id))""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY, balance INTEGER DEFAULT 0, referrer_id INTEGER,
-            referral_count INTEGER DEFAULT 0, daily_withdraw_date TEXT, aisports_bonus_received INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (referrer_id) REFERENCES users(user_id))""")
-        try:
-            await db.execute("ALTER TABLE match_analyses ADD COLUMN analysis_url TEXT")
-        except:
-            pass
-        try:
-            await db.execute("ALTER TABLE users ADD COLUMN aisports_bonus_received INTEGER DEFAULT 0")
-        except:
-            pass
-        await db.execute("CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY AUTOINCREMENT, referrer_id INTEGER NOT NULL, referred_id INTEGER NOT NULL, bonus INTEGER DEFAULT 2000, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(referred_id))")
-        await db.execute("CREATE TABLE IF NOT EXISTS withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, amount INTEGER NOT NULL, status TEXT DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    if db_pool is None:
+        db_pool = DBPool(DB_PATH)
+        await db_pool.open()
+    async with db_pool.writer() as db:
+        await run_migrations(db)
+        for main_admin in MAIN_ADMINS:
+            async with db.execute("INSERT OR IGNORE INTO admins (user_id, added_by) VALUES (?, ?)", (main_admin, main_admin)) as cur:
+                if cur.rowcount == 1:
+                    logger.info(f"Asosiy admin qo'shildi: {main_admin}")
         await db.commit()
-    MAIN_ADMIN = 6935090105
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT user_id FROM admins WHERE user_id = ?", (MAIN_ADMIN,)) as cur:
-            if not await cur.fetchone():
-                await db.execute("INSERT INTO admins (user_id, added_by) VALUES (?, ?)", (MAIN_ADMIN, MAIN_ADMIN))
-                await db.commit()
-                logger.info(f"Asosiy admin qo'shildi: {MAIN_ADMIN}")
+        async with db.execute("SELECT value FROM meta WHERE key = 'db_id'") as cur:
+            DB_ID = (await cur.fetchone())[0]
+    await load_admins()
+
+async def close_db():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
 
 # ========== USER FUNCTIONS ==========
-async def get_or_create_user(user_id: int, referrer_id: int = None, bot=None, referred_name=None):
-    async with aiosqlite.connect(DB_PATH) as db:
+@observe_db
+async def get_or_create_user(user_id: int, referrer_id: int = None, referred_name: str = None):
+    async with db_pool.reader() as db:
         async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cur:
             user = await cur.fetchone()
-        if not user:
-            await db.execute("INSERT INTO users (user_id, referrer_id, aisports_bonus_received) VALUES (?, ?, 0)", (user_id, referrer_id))
-            await db.commit()
-            if referrer_id and referrer_id != user_id:
-                async with db.execute("SELECT user_id FROM users WHERE user_id = ?", (referrer_id,)) as cur:
-                    if await cur.fetchone():
-                        await db.execute("UPDATE users SET balance = balance + ?, referral_count = referral_count + 1 WHERE user_id = ?", (REFERRAL_BONUS, referrer_id))
-                        await db.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus) VALUES (?, ?, ?)", (referrer_id, user_id, REFERRAL_BONUS))
-                        await db.commit()
-                        if bot and referred_name:
-                            asyncio.create_task(send_referral_notification(referrer_id, referred_name, REFERRAL_BONUS, bot))
-            async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cur:
-                user = await cur.fetchone()
-    return user
-
-async def send_referral_notification(referrer_id: int, referred_name: str, bonus: int, bot):
-    try:
-        await bot.send_message(referrer_id,
-            f"🎉 **Tabriklaymiz!**\n\nSizning taklif havolangiz orqali {referred_name} botga qoʻshildi.\n💰 Hisobingizga **{bonus:,} soʻm** bonus qoʻshildi!\n\n📊 Doʻstlaringizni koʻproq taklif qilib pul ishlang.",
-            parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Referal xabar yuborilmadi ({referrer_id}): {e}")
+    if user:
+        return user
+    async with db_pool.writer() as db:
+        async with db.execute("INSERT OR IGNORE INTO users (user_id, referrer_id, aisports_bonus_received) VALUES (?, ?, 0)", (user_id, referrer_id)) as cur:
+            created = cur.rowcount == 1
+        rewarded = False
+        notification = None
+        if created and referrer_id and referrer_id != user_id:
+            async with db.execute("SELECT user_id FROM users WHERE user_id = ?", (referrer_id,)) as cur:
+                referrer_exists = await cur.fetchone() is not None
+            if referrer_exists:
+                async with db.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus) VALUES (?, ?, ?)", (referrer_id, user_id, REFERRAL_BONUS)) as cur:
+                    rewarded = cur.rowcount == 1
+            if rewarded and referred_name:
+                notification = {"referrer_id": referrer_id, "referred_name": referred_name, "bonus": REFERRAL_BONUS}
+                if state_backend.transactional_jobs:
+                    await state_backend.enqueue_job("referral_notification", notification, db=db)
+            if rewarded:
+                # Profil hisoblagichlari yozish paytida yangilanadi – oʻqishda agregat soʻrov kerak emas
+                await db.execute("""UPDATE users SET balance = balance + ?, referral_count = referral_count + 1,
+                    referral_bonus_total = referral_bonus_total + ?,
+                    referrals_today = CASE WHEN referrals_today_date = DATE('now') THEN referrals_today + 1 ELSE 1 END,
+                    referrals_today_date = DATE('now')
+                    WHERE user_id = ?""", (REFERRAL_BONUS, REFERRAL_BONUS, referrer_id))
+        await db.commit()
+    if notification and not state_backend.transactional_jobs:
+        await state_backend.enqueue_job("referral_notification", notification)
+    if rewarded:
+        job_wakeup.set()
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cur:
+            return await cur.fetchone()
 
-async def get_user_balance(user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else 0
+async def send_referral_notification(bot, referrer_id: int, referred_name: str, bonus: int):
+    await send_job_message(bot, referrer_id,
+        text=f"🎉 **Tabriklaymiz!**\n\nSizning taklif havolangiz orqali {referred_name} botga qoʻshildi.\n💰 Hisobingizga **{bonus:,} soʻm** bonus qoʻshildi!\n\n📊 Doʻstlaringizni koʻproq taklif qilib pul ishlang.",
+        parse_mode="Markdown")
 
-async def can_withdraw(user_id: int):
-    balance = await get_user_balance(user_id)
-    if balance < MIN_WITHDRAW:
-        return False, f"❌ Minimal yechish miqdori {MIN_WITHDRAW:,} soʻm. Sizda {balance:,} soʻm bor."
+@observe_db
+async def register_withdraw(user_id: int, amount: int):
+    """
+    Tekshiruv va yechish bitta BEGIN IMMEDIATE tranzaksiyada: ikki tez bosishdan faqat bittasi oʻtadi.
+    (True, qolgan_balans) yoki (False, xabar) qaytaradi.
+    """
     today_str = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT daily_withdraw_date FROM users WHERE user_id = ?", (user_id,)) as cur:
+    async with db_pool.writer() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute("""UPDATE users SET balance = balance - ?, daily_withdraw_date = ?
+            WHERE user_id = ? AND balance >= ? AND balance >= ?
+              AND (daily_withdraw_date IS NULL OR daily_withdraw_date != ?)
+            RETURNING balance""", (amount, today_str, user_id, amount, MIN_WITHDRAW, today_str)) as cur:
             row = await cur.fetchone()
-            if row and row[0] == today_str:
-                return False, "❌ Bugun siz allaqachon pul yechib boʻlgansiz. Ertaga qayta urinib koʻring."
-    return True, ""
-
-async def register_withdraw(user_id: int, amount: int) -> bool:
-    can, msg = await can_withdraw(user_id)
-    if not can: return False
-    if amount > await get_user_balance(user_id): return False
-    today_str = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET balance = balance - ?, daily_withdraw_date = ? WHERE user_id = ?", (amount, today_str, user_id))
+        if row is None:
+            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cur:
+                current = await cur.fetchone()
+            await db.rollback()
+            balance = current[0] if current else 0
+            if balance < max(amount, MIN_WITHDRAW):
+                return False, (f"❌ Sizda yetarli mablagʻ yoʻq.\nBalans: **{balance:,} soʻm**\nMinimal yechish: **{MIN_WITHDRAW:,} soʻm**\n\n"
+                               f"Doʻstlaringizni taklif qilib pul ishlang!")
+            return False, "❌ Bugun siz allaqachon pul yechib boʻlgansiz. Ertaga qayta urinib koʻring."
         await db.execute("INSERT INTO withdrawals (user_id, amount, status) VALUES (?, ?, ?)", (user_id, amount, 'completed'))
         await db.commit()
-    return True
+        return True, row[0]
 
-async def get_referral_link(user_id: int, bot_username: str) -> str:
-    return f"https://t.me/{bot_username}?start=ref_{user_id}"
+def get_referral_link(user_id: int, bot_username: str = None) -> str:
+    return f"https://t.me/{bot_username or BOT_USERNAME}?start=ref_{user_id}"
 
-async def get_referral_stats(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT referral_count FROM users WHERE user_id = ?", (user_id,)) as cur:
-            cnt = (await cur.fetchone())[0] or 0
-        async with db.execute("SELECT SUM(bonus) FROM referrals WHERE referrer_id = ?", (user_id,)) as cur:
-            total = (await cur.fetchone())[0] or 0
-        async with db.execute("SELECT COUNT(*) FROM referrals WHERE referrer_id = ? AND DATE(created_at) = DATE('now')", (user_id,)) as cur:
-            today = (await cur.fetchone())[0] or 0
-        return {"count": cnt, "total_bonus": total, "today_count": today}
+@observe_db
+async def get_user_profile(user_id: int):
+    async with db_pool.reader() as db:
+        async with db.execute("""SELECT balance, referral_count, referral_bonus_total,
+            CASE WHEN referrals_today_date = DATE('now') THEN referrals_today ELSE 0 END
+            FROM users WHERE user_id = ?""", (user_id,)) as cur:
+            row = await cur.fetchone()
+    balance, count, total, today = row or (0, 0, 0, 0)
+    return {"balance": balance or 0, "count": count or 0, "total_bonus": total or 0, "today_count": today or 0}
 
 # ========== AISPORTS BONUS ==========
-async def give_aisports_bonus(user_id: int, bot):
-    await asyncio.sleep(random.randint(60, 120))
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT aisports_bonus_received FROM users WHERE user_id = ?", (user_id,)) as cur:
+async def give_aisports_bonus(bot, user_id: int):
+    async with db_pool.writer() as db:
+        async with db.execute("""UPDATE users SET balance = balance + ?, aisports_bonus_received = 1
+            WHERE user_id = ? AND aisports_bonus_received = 0 RETURNING balance""", (AISPORTS_BONUS, user_id)) as cur:
             row = await cur.fetchone()
-            if not row or row[0] == 1:
-                return
-        await db.execute("UPDATE users SET balance = balance + ?, aisports_bonus_received = 1 WHERE user_id = ?", (AISPORTS_BONUS, user_id))
+        if not row:
+            async with db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)) as cur:
+                if await cur.fetchone() is None:
+                    # Jimgina "bajarildi" deb oʻchirilmasin – finish_job qayta urinadi va oxirida xatoni yozadi
+                    raise LookupError(f"Foydalanuvchi {user_id} bazada yoʻq")
+        # Xabar alohida vazifa: yuborilmasa bonus qayta berilmaydi, faqat xabar qayta uriniladi
+        notification = {"user_id": user_id, "balance": row[0]} if row else None
+        if notification and state_backend.transactional_jobs:
+            await state_backend.enqueue_job("aisports_notification", notification, db=db)
         await db.commit()
-    try:
-        await bot.send_message(user_id,
-            f"🎁 **30 000 soʻm aisports dan bonus puli hisobingizga qoʻshildi!**\n\n💰 Yangi balans: {await get_user_balance(user_id):,} soʻm\n\n📊 Doʻstlaringizni taklif qilib yana pul ishlashingiz mumkin.",
-            parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Aisports bonus xabari yuborilmadi ({user_id}): {e}")
+    if not notification:
+        return
+    if not state_backend.transactional_jobs:
+        await state_backend.enqueue_job("aisports_notification", notification)
+    job_wakeup.set()
+
+async def send_aisports_notification(bot, user_id: int, balance: int):
+    await send_job_message(bot, user_id,
+        text=f"🎁 **30 000 soʻm aisports dan bonus puli hisobingizga qoʻshildi!**\n\n💰 Yangi balans: {balance:,} soʻm\n\n📊 Doʻstlaringizni taklif qilib yana pul ishlashingiz mumkin.",
+        parse_mode="Markdown")
 
+@observe_db
 async def schedule_aisports_bonus(user_id: int, context):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT aisports_bonus_received FROM users WHERE user_id = ?", (user_id,)) as cur:
             row = await cur.fetchone()
-            if not row or row[0] == 0:
-                asyncio.create_task(give_aisports_bonus(user_id, context.bot))
+    if not row or row[0] == 0:
+        await state_backend.enqueue_job("aisports_bonus", {"user_id": user_id}, delay=random.randint(60, 120), dedupe_key=str(user_id))
+
+# ========== JOB QUEUE ==========
+JOB_BATCH_SIZE = 50
+JOB_LOCK_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 5
+JOB_IDLE_SLEEP = 60
+
+job_wakeup = asyncio.Event()
+
+@observe_db
+async def enqueue_job(kind: str, payload: dict, delay: float = 0, dedupe_key: str = None, db=None):
+    """Kechiktirilgan vazifani bazaga yozadi; db berilsa chaqiruvchining tranzaksiyasida (commit chaqiruvchida)."""
+    params = (kind, dedupe_key, json.dumps(payload), time.time() + delay)
+    sql = "INSERT OR IGNORE INTO jobs (kind, dedupe_key, payload, run_at) VALUES (?, ?, ?, ?)"
+    if db is not None:
+        await db.execute(sql, params)
+        return
+    async with db_pool.writer() as db:
+        await db.execute(sql, params)
+        await db.commit()
+    job_wakeup.set()
+
+@observe_db
+async def claim_jobs(limit: int = JOB_BATCH_SIZE):
+    now = time.time()
+    async with db_pool.writer() as db:
+        # Olingan vazifaning run_at i lock muddatiga suriladi: ishchi qulasa JOB_LOCK_TIMEOUT dan keyin qayta olinadi
+        async with db.execute("""UPDATE jobs SET run_at = ?, attempts = attempts + 1
+            WHERE id IN (SELECT id FROM jobs WHERE run_at <= ? ORDER BY run_at LIMIT ?)
+            RETURNING id, kind, payload, attempts""", (now + JOB_LOCK_TIMEOUT, now, limit)) as cur:
+            rows = await cur.fetchall()
+        await db.commit()
+        return rows
+
+@observe_db
+async def finish_job(job_id: int, kind: str, attempts: int, error: Exception = None):
+    async with db_pool.writer() as db:
+        if error is None or attempts >= JOB_MAX_ATTEMPTS:
+            if error is not None:
+                logger.error(f"Vazifa {job_id} ({kind}) {attempts} urinishdan keyin tashlab yuborildi: {error}")
+            await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        else:
+            await db.execute("UPDATE jobs SET run_at = ? WHERE id = ?",
+                             (time.time() + 30 * 2 ** attempts, job_id))
+        await db.commit()
+
+@observe_db
+async def next_job_delay() -> float:
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT MIN(run_at) FROM jobs") as cur:
+            next_at = (await cur.fetchone())[0]
+    if next_at is None:
+        return JOB_IDLE_SLEEP
+    return min(max(next_at - time.time(), 0), JOB_IDLE_SLEEP)
+
+async def send_job_message(bot, chat_id: int, **kwargs):
+    """
+    Vazifa ichidan xabar yuborish. Forbidden/BadRequest – qayta urinish befoyda, vazifa yakunlanadi;
+    boshqa xatolar yuqoriga uzatiladi va finish_job vazifani qayta rejalashtiradi.
+    """
+    try:
+        await _telegram_call(lambda: bot.send_message(chat_id, **kwargs))
+    except (Forbidden, BadRequest) as e:
+        logger.warning(f"Vazifa xabari yuborilmadi (user {chat_id}): {e}")
+
+JOB_HANDLERS = {
+    "aisports_bonus": give_aisports_bonus,
+    "aisports_notification": send_aisports_notification,
+    "referral_notification": send_referral_notification,
+}
+
+async def _run_job(bot, job_id: int, kind: str, payload: str, attempts: int):
+    try:
+        await JOB_HANDLERS[kind](bot, **json.loads(payload))
+    except Exception as e:
+        await state_backend.finish_job(job_id, kind, attempts, e)
+    else:
+        await state_backend.finish_job(job_id, kind, attempts)
+
+async def job_worker(bot):
+    """Yagona taymerli ishchi: muddati kelgan vazifalarni partiyalab oladi va bajaradi."""
+    while True:
+        job_wakeup.clear()
+        try:
+            jobs = await state_backend.claim_jobs()
+            if jobs:
+                await asyncio.gather(*(_run_job(bot, *job) for job in jobs))
+            if len(jobs) == JOB_BATCH_SIZE:
+                continue
+            delay = await state_backend.next_job_delay()
+        except Exception as e:
+            logger.exception(f"Vazifalar ishchisi xatosi: {e}")
+            delay = 5
+        try:
+            await asyncio.wait_for(job_wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
 
 # ========== ADMIN ==========
-async def is_admin(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)) as cur:
-            return await cur.fetchone() is not None
+ADMIN_SYNC_INTERVAL = int(os.environ.get("ADMIN_SYNC_INTERVAL", 5))
+
+admin_ids = MAIN_ADMINS
+admins_version = 0
 
+@observe_db
+async def load_admins():
+    global admin_ids, admins_version
+    # Versiya oʻqishdan oldin olinadi: oraliqdagi oʻzgarish keyingi tekshiruvda baribir koʻrinadi
+    admins_version = await state_backend.get_version("admins")
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT user_id FROM admins") as cur:
+            admin_ids = MAIN_ADMINS | frozenset(row[0] for row in await cur.fetchall())
+
+def is_admin(user_id: int) -> bool:
+    return user_id in admin_ids
+
+@observe_db
 async def add_admin(user_id: int, added_by: int) -> bool:
+    global admin_ids
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with db_pool.writer() as db:
             await db.execute("INSERT INTO admins (user_id, added_by) VALUES (?, ?)", (user_id, added_by))
             await db.commit()
-            return True
     except:
         return False
+    admin_ids = admin_ids | {user_id}
+    await state_backend.bump_version("admins")
+    return True
 
+@observe_db
 async def remove_admin(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    global admin_ids
+    if user_id in MAIN_ADMINS:
+        return False
+    async with db_pool.writer() as db:
         await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
         await db.commit()
-        return True
+    admin_ids = admin_ids - {user_id}
+    await state_backend.bump_version("admins")
+    return True
 
+async def admin_syncer():
+    """Boshqa worker admin qoʻshsa/olib tashlasa umumiy versiya oʻzgaradi – roʻyxat bazadan qayta oʻqiladi."""
+    while True:
+        await asyncio.sleep(ADMIN_SYNC_INTERVAL)
+        try:
+            if await state_backend.get_version("admins") != admins_version:
+                await load_admins()
+                logger.info(f"Adminlar roʻyxati yangilandi: {len(admin_ids)} ta")
+        except Exception as e:
+            logger.exception(f"Adminlarni sinxronlash xatosi: {e}")
+
+@observe_db
 async def get_all_admins():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT user_id, added_by, added_at FROM admins ORDER BY added_at") as cur:
             return await cur.fetchall()
 
+@observe_db
+async def get_bot_stats():
+    async with db_pool.reader() as db:
+        # Referallar soni users.referral_count dan olinadi (har bir referal bilan birga oshadi):
+        # users bir marta oʻqiladi, referrals jadvali butunlay skan qilinmaydi
+        async with db.execute("""SELECT COUNT(*), COALESCE(SUM(referral_count), 0), COALESCE(SUM(balance), 0),
+            (SELECT COUNT(*) FROM withdrawals WHERE status='completed'),
+            (SELECT COALESCE(SUM(amount), 0) FROM withdrawals WHERE status='completed')
+            FROM users""") as cur:
+            return await cur.fetchone()
+
 # ========== ANALYSIS ==========
+@observe_db
 async def update_analysis_text(match_id: int, analysis: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.writer() as db:
         await db.execute("""
             INSERT INTO match_analyses (match_id, analysis, added_by)
             VALUES (?, ?, ?)
@@ -255,9 +1171,11 @@ async def update_analysis_text(match_id: int, analysis: str, added_by: int):
                 added_at = CURRENT_TIMESTAMP
         """, (match_id, analysis, added_by))
         await db.commit()
+    invalidate_render(match_id)
 
+@observe_db
 async def update_analysis_url(match_id: int, url: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.writer() as db:
         async with db.execute("SELECT analysis FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
             row = await cur.fetchone()
         if row:
@@ -272,9 +1190,11 @@ async def update_analysis_url(match_id: int, url: str, added_by: int):
                 VALUES (?, ?, ?, ?)
             """, (match_id, "📝 Tahlil kutilmoqda", url, added_by))
         await db.commit()
+    invalidate_render(match_id)
 
+@observe_db
 async def add_full_analysis(match_id: int, analysis: str, url: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.writer() as db:
         await db.execute("""
             INSERT INTO match_analyses (match_id, analysis, analysis_url, added_by)
             VALUES (?, ?, ?, ?)
@@ -285,66 +1205,518 @@ async def add_full_analysis(match_id: int, analysis: str, url: str, added_by: in
                 added_at = CURRENT_TIMESTAMP
         """, (match_id, analysis, url, added_by))
         await db.commit()
+    invalidate_render(match_id)
 
+@observe_db
 async def get_analysis(match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT analysis, analysis_url, added_at FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
             return await cur.fetchone()
 
 # ========== SUBSCRIPTIONS ==========
+FLAG_CLAIMED = 2
+FLAG_BATCH_SIZE = 1000
+FLAG_FLUSH_INTERVAL = 1.0
+FLAG_CHUNK = 500
+
+@observe_db
 async def subscribe_user(user_id: int, match_id: int, match_time: str, home: str, away: str, league: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.writer() as db:
         await db.execute("""INSERT OR REPLACE INTO subscriptions 
             (user_id, match_id, match_time, home_team, away_team, league_code, notified_1h, notified_15m, notified_lineups)
             VALUES (?, ?, ?, ?, ?, ?, 0, 0, 0)""", (user_id, match_id, match_time, home, away, league))
         await db.commit()
+    notification_queue.schedule_match(match_id, datetime.strptime(match_time, "%Y-%m-%dT%H:%M:%SZ"))
 
+@observe_db
 async def unsubscribe_user(user_id: int, match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.writer() as db:
         await db.execute("DELETE FROM subscriptions WHERE user_id = ? AND match_id = ?", (user_id, match_id))
         await db.commit()
+        async with db.execute("SELECT 1 FROM subscriptions WHERE match_id = ? LIMIT 1", (match_id,)) as cur:
+            if await cur.fetchone() is None:
+                notification_queue.discard_match(match_id)
+
+@observe_db
+async def is_subscribed(user_id: int, match_id: int) -> bool:
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (user_id, match_id)) as cur:
+            return await cur.fetchone() is not None
 
-async def get_all_subscriptions():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""SELECT user_id, match_id, match_time, home_team, away_team, league_code,
-            notified_1h, notified_15m, notified_lineups FROM subscriptions""") as cur:
-            return await cur.fetchall()
+@observe_db
+async def get_pending_notification_matches():
+    since = (datetime.utcnow() - timedelta(minutes=max(NOTIFICATION_OFFSETS.values()))).strftime("%Y-%m-%dT%H:%M:%SZ")
+    async with db_pool.reader() as db:
+        async with db.execute("""SELECT match_id, match_time, MIN(notified_1h) = 0, MIN(notified_15m) = 0 FROM subscriptions
+            WHERE match_time > ? AND (notified_1h = 0 OR notified_15m = 0) GROUP BY match_id, match_time""", (since,)) as cur:
+            rows = await cur.fetchall()
+    # (match_id, match_time, hali yuborilmagan turlar)
+    return [(mid, tstr, [kind for kind, pending in zip(NOTIFICATION_OFFSETS, flags) if pending])
+            for mid, tstr, *flags in rows]
 
-async def update_notification_flags(user_id: int, match_id: int, **kwargs):
-    async with aiosqlite.connect(DB_PATH) as db:
-        updates = []
-        params = []
-        if kwargs.get('one_hour'):
-            updates.append("notified_1h = 1")
-        if kwargs.get('fifteen_min'):
-            updates.append("notified_15m = 1")
-        if kwargs.get('lineups'):
-            updates.append("notified_lineups = 1")
-        if not updates: return
-        query = f"UPDATE subscriptions SET {', '.join(updates)} WHERE user_id = ? AND match_id = ?"
-        params.extend([user_id, match_id])
-        await db.execute(query, params)
+@observe_db
+async def claim_subscribers(match_id: int, flag: str):
+    """
+    Hali xabar olmagan obunachilarni 2 (yuborilmoqda) deb belgilab qaytaradi.
+    Yuborishdan oldin yoziladi – qayta ishga tushganda xabar takror yuborilmaydi.
+    """
+    async with db_pool.writer() as db:
+        async with db.execute(f"""UPDATE subscriptions SET {flag} = {FLAG_CLAIMED} WHERE match_id = ? AND {flag} = 0
+            RETURNING user_id, home_team, away_team, league_code, match_time""", (match_id,)) as cur:
+            rows = await cur.fetchall()
         await db.commit()
+        return rows
+
+class FlagBatcher:
+    """Yetkazilgan bildirishnoma bayroqlarini yigʻib, (match, tur) boʻyicha bitta tranzaksiyada yozadi."""
+
+    def __init__(self, max_batch: int = FLAG_BATCH_SIZE, interval: float = FLAG_FLUSH_INTERVAL):
+        self.max_batch = max_batch
+        self.interval = interval
+        self._pending = {}
+        self._count = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    def add(self, flag: str, match_id: int, user_id: int):
+        self._pending.setdefault((flag, match_id), set()).add(user_id)
+        self._count += 1
+        if self._count >= self.max_batch:
+            asyncio.create_task(self.flush()).add_done_callback(_log_task_error)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    @observe_db
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending, self._count = self._pending, {}, 0
+            async with db_pool.writer() as db:
+                for (flag, match_id), users in pending.items():
+                    users = list(users)
+                    for i in range(0, len(users), FLAG_CHUNK):
+                        chunk = users[i:i + FLAG_CHUNK]
+                        await db.execute(f"UPDATE subscriptions SET {flag} = 1 WHERE match_id = ? AND user_id IN ({','.join('?' * len(chunk))})",
+                                         (match_id, *chunk))
+                await db.commit()
+
+flag_batcher = FlagBatcher()
 
+async def update_notification_flags(user_id: int, match_id: int, **kwargs):
+    if kwargs.get('one_hour'):
+        flag_batcher.add("notified_1h", match_id, user_id)
+    if kwargs.get('fifteen_min'):
+        flag_batcher.add("notified_15m", match_id, user_id)
+    if kwargs.get('lineups'):
+        flag_batcher.add("notified_lineups", match_id, user_id)
+
+@observe_db
 async def get_subscribers_for_match(match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.reader() as db:
         async with db.execute("SELECT user_id FROM subscriptions WHERE match_id = ?", (match_id,)) as cur:
             rows = await cur.fetchall()
             return [r[0] for r in rows]
 
+# ========== DISK CACHE ==========
+DISK_CACHE_RETENTION = int(os.environ.get("DISK_CACHE_RETENTION", 2 * 86400))
+
+@observe_db
+async def disk_cache_get(key: str):
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT payload, etag, fetched_at, expires_at FROM api_cache WHERE cache_key = ?", (key,)) as cur:
+            row = await cur.fetchone()
+    if not row:
+        return None
+    return {"payload": json.loads(row[0]), "etag": row[1], "fetched_at": row[2], "expires_at": row[3]}
+
+@observe_db
+async def disk_cache_set(key: str, payload, ttl: float, etag: str = None):
+    now = time.time()
+    async with db_pool.writer() as db:
+        await db.execute("""INSERT INTO api_cache (cache_key, payload, etag, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET payload = excluded.payload, etag = excluded.etag,
+                fetched_at = excluded.fetched_at, expires_at = excluded.expires_at""",
+            (key, json.dumps(payload, separators=(",", ":")), etag, now, now + ttl))
+        await db.commit()
+
+@observe_db
+async def disk_cache_set_many(items, ttl_fn, keep_fresh: bool = True):
+    """Koʻp yozuvni bitta tranzaksiyada saqlaydi; keep_fresh boʻlsa hali amal qiladigan yozuvlar tegilmaydi."""
+    now = time.time()
+    rows = [(key, json.dumps(payload, separators=(",", ":")), None, now, now + ttl_fn(payload)) for key, payload in items]
+    condition = "WHERE api_cache.expires_at < excluded.fetched_at" if keep_fresh else ""
+    async with db_pool.writer() as db:
+        await db.executemany(f"""INSERT INTO api_cache (cache_key, payload, etag, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET payload = excluded.payload, etag = excluded.etag,
+                fetched_at = excluded.fetched_at, expires_at = excluded.expires_at {condition}""", rows)
+        await db.commit()
+
+@observe_db
+async def disk_cache_purge():
+    async with db_pool.writer() as db:
+        await db.execute("DELETE FROM api_cache WHERE expires_at < ?", (time.time() - DISK_CACHE_RETENTION,))
+        await db.commit()
+
+# ========== STATE BACKEND ==========
+# Bir nechta worker uchun umumiy holat: API tokenlari, kesh, lease'lar va vazifalar navbati.
+# STATE_BACKEND_URL berilmasa hammasi shu jarayonda (kesh va navbat – SQLite da) qoladi.
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL")
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "footbot")
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+class LocalStateBackend:
+    """Bitta jarayon uchun: tokenlarni mahalliy TokenBucket, kesh va navbatni SQLite boshqaradi."""
+
+    name = "local"
+    # Vazifa foydalanuvchi tranzaksiyasi ichida yozilishi mumkin (enqueue_job(db=...))
+    transactional_jobs = True
+
+    def __init__(self):
+        self._leases = {}
+        self._versions = {}
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def acquire_token(self, name: str, rate: float, per: float):
+        pass
+
+    async def pause_tokens(self, name: str, seconds: float):
+        pass
+
+    async def cache_get(self, key: str):
+        return await disk_cache_get(key)
+
+    async def cache_set(self, key: str, payload, ttl: float, etag: str = None):
+        await disk_cache_set(key, payload, ttl, etag)
+
+    async def cache_set_many(self, items, ttl_fn, keep_fresh: bool = True):
+        await disk_cache_set_many(items, ttl_fn, keep_fresh)
+
+    async def cache_purge(self):
+        await disk_cache_purge()
+
+    async def acquire_lease(self, name: str, ttl: float) -> bool:
+        """Lease boʻsh yoki allaqachon bizniki boʻlsa True (muddati uzaytiriladi)."""
+        now = time.monotonic()
+        owner, expires_at = self._leases.get(name, (None, 0))
+        if owner not in (None, WORKER_ID) and expires_at > now:
+            return False
+        self._leases[name] = (WORKER_ID, now + ttl)
+        return True
+
+    async def release_lease(self, name: str):
+        if self._leases.get(name, (None,))[0] == WORKER_ID:
+            del self._leases[name]
+
+    async def get_version(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    async def get_message_hash(self, chat_id: int, message_id: int):
+        return message_hashes.get((chat_id, message_id), count=False)
+
+    async def set_message_hash(self, chat_id: int, message_id: int, digest: str):
+        message_hashes.set((chat_id, message_id), digest, EDIT_HASH_TTL, size=len(digest))
+
+    async def forget_message_hash(self, chat_id: int, message_id: int):
+        message_hashes.pop((chat_id, message_id))
+
+    async def bump_version(self, name: str) -> int:
+        """Bazadagi maʼlumot oʻzgarganini bildiradi – mahalliy nusxalar qayta yuklanadi."""
+        self._versions[name] = self._versions.get(name, 0) + 1
+        return self._versions[name]
+
+    async def enqueue_job(self, kind: str, payload: dict, delay: float = 0, dedupe_key: str = None, db=None):
+        await enqueue_job(kind, payload, delay, dedupe_key, db)
+
+    async def claim_jobs(self, limit: int = JOB_BATCH_SIZE):
+        return await claim_jobs(limit)
+
+    async def finish_job(self, job_id, kind: str, attempts: int, error: Exception = None):
+        await finish_job(job_id, kind, attempts, error)
+
+    async def next_job_delay(self) -> float:
+        return await next_job_delay()
+
+    async def snapshot(self):
+        return {"backend": self.name, "worker": WORKER_ID, "leases": len(self._leases)}
+
+_TOKEN_BUCKET_LUA = """
+local rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'paused_until')
+local tokens, ts, paused = tonumber(state[1]), tonumber(state[2]), tonumber(state[3]) or 0
+if now < paused then return tostring(paused - now) end
+if tokens == nil or paused > 0 then tokens, ts = capacity, now end
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'paused_until', '0')
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+_PAUSE_LUA = """
+local until_ = tonumber(ARGV[1])
+if until_ > (tonumber(redis.call('HGET', KEYS[1], 'paused_until')) or 0) then
+    redis.call('HSET', KEYS[1], 'paused_until', ARGV[1], 'tokens', '0')
+end
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])) + 60)
+"""
+
+_ACQUIRE_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if owner then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+_RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_ENQUEUE_JOB_LUA = """
+if redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[2]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_CLAIM_JOBS_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+local out = {}
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[1], ARGV[2], id)
+    local attempts = redis.call('HINCRBY', KEYS[3], id, 1)
+    table.insert(out, id)
+    table.insert(out, redis.call('HGET', KEYS[2], id))
+    table.insert(out, attempts)
+end
+return out
+"""
+
+class RedisStateBackend:
+    """Redis (yoki unga mos server) orqali bir nechta worker oʻrtasida umumiy holat."""
+
+    name = "redis"
+    # Navbat SQLite da emas – vazifa tranzaksiya commit qilingandan keyin yoziladi
+    transactional_jobs = False
+
+    def __init__(self, url: str, prefix: str = STATE_KEY_PREFIX, client=None):
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("STATE_BACKEND_URL uchun redis paketi kerak: pip install redis")
+            client = aioredis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self._take = client.register_script(_TOKEN_BUCKET_LUA)
+        self._pause = client.register_script(_PAUSE_LUA)
+        self._acquire = client.register_script(_ACQUIRE_LEASE_LUA)
+        self._release = client.register_script(_RELEASE_LEASE_LUA)
+        self._enqueue = client.register_script(_ENQUEUE_JOB_LUA)
+        self._claim = client.register_script(_CLAIM_JOBS_LUA)
+
+    def _key(self, *parts) -> str:
+        return ":".join((self.prefix,) + tuple(str(p) for p in parts))
+
+    def _db_key(self, *parts) -> str:
+        """Bazadagi maʼlumotga tayanadigan kalit: faqat shu bazani ishlatuvchi workerlar oʻrtasida umumiy."""
+        return self._key("db", DB_ID, *parts)
+
+    @property
+    def _job_keys(self):
+        return [self._db_key("jobs", "due"), self._db_key("jobs", "data"), self._db_key("jobs", "attempts")]
+
+    async def open(self):
+        await self.redis.ping()
+        logger.info(f"Umumiy holat: Redis ({self.prefix}), worker {WORKER_ID}")
+
+    async def close(self):
+        await self.redis.aclose()
+
+    async def acquire_token(self, name: str, rate: float, per: float):
+        """Barcha workerlar uchun umumiy token-bucket: token boʻlmasa kerakli vaqtcha kutadi."""
+        while True:
+            wait = float(await self._take(keys=[self._key("tokens", name)], args=[rate / per, rate, time.time()]))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def pause_tokens(self, name: str, seconds: float):
+        await self._pause(keys=[self._key("tokens", name)], args=[time.time() + seconds, seconds])
+
+    async def cache_get(self, key: str):
+        raw = await self.redis.get(self._key("cache", key))
+        return json.loads(raw) if raw else None
+
+    def _cache_record(self, payload, ttl: float, etag: str, now: float):
+        record = {"payload": payload, "etag": etag, "fetched_at": now, "expires_at": now + ttl}
+        # Eskirgan nusxa ham API ishlamaganda kerak – SQLite dagi kabi DISK_CACHE_RETENTION saqlanadi
+        return json.dumps(record, separators=(",", ":")), int(ttl + DISK_CACHE_RETENTION)
+
+    async def cache_set(self, key: str, payload, ttl: float, etag: str = None):
+        value, ex = self._cache_record(payload, ttl, etag, time.time())
+        await self.redis.set(self._key("cache", key), value, ex=ex)
+
+    async def cache_set_many(self, items, ttl_fn, keep_fresh: bool = True):
+        items = list(items)
+        if not items:
+            return
+        now = time.time()
+        keys = [self._key("cache", key) for key, _ in items]
+        current = await self.redis.mget(keys) if keep_fresh else [None] * len(items)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for rkey, (_, payload), raw in zip(keys, items, current):
+                if raw and json.loads(raw)["expires_at"] >= now:
+                    continue
+                value, ex = self._cache_record(payload, ttl_fn(payload), None, now)
+                pipe.set(rkey, value, ex=ex)
+            await pipe.execute()
+
+    async def cache_purge(self):
+        # Redis yozuvlari EX bilan oʻzi oʻchadi
+        pass
+
+    async def acquire_lease(self, name: str, ttl: float) -> bool:
+        """Lease boʻsh yoki allaqachon bizniki boʻlsa True (muddati uzaytiriladi)."""
+        return bool(await self._acquire(keys=[self._key("lease", name)], args=[WORKER_ID, int(ttl * 1000)]))
+
+    async def release_lease(self, name: str):
+        await self._release(keys=[self._key("lease", name)], args=[WORKER_ID])
+
+    async def get_version(self, name: str) -> int:
+        return int(await self.redis.get(self._db_key("version", name)) or 0)
+
+    async def get_message_hash(self, chat_id: int, message_id: int):
+        return await self.redis.get(self._key("msg", chat_id, message_id))
+
+    async def set_message_hash(self, chat_id: int, message_id: int, digest: str):
+        await self.redis.set(self._key("msg", chat_id, message_id), digest, ex=EDIT_HASH_TTL)
+
+    async def forget_message_hash(self, chat_id: int, message_id: int):
+        await self.redis.delete(self._key("msg", chat_id, message_id))
+
+    async def bump_version(self, name: str) -> int:
+        """Bazadagi maʼlumot oʻzgarganini bildiradi – boshqa workerlar mahalliy nusxani qayta yuklaydi."""
+        return await self.redis.incr(self._db_key("version", name))
+
+    async def enqueue_job(self, kind: str, payload: dict, delay: float = 0, dedupe_key: str = None, db=None):
+        job_id = f"{kind}:{dedupe_key}" if dedupe_key is not None else f"{kind}:{secrets.token_hex(8)}"
+        data = json.dumps({"kind": kind, "payload": payload}, separators=(",", ":"))
+        await self._enqueue(keys=self._job_keys[:2], args=[job_id, data, time.time() + delay])
+        job_wakeup.set()
+
+    async def claim_jobs(self, limit: int = JOB_BATCH_SIZE):
+        now = time.time()
+        raw = await self._claim(keys=self._job_keys, args=[now, now + JOB_LOCK_TIMEOUT, limit])
+        jobs = []
+        for job_id, data, attempts in zip(raw[0::3], raw[1::3], raw[2::3]):
+            if data is None:
+                await self.redis.zrem(self._job_keys[0], job_id)
+                continue
+            job = json.loads(data)
+            jobs.append((job_id, job["kind"], json.dumps(job["payload"]), int(attempts)))
+        return jobs
+
+    async def finish_job(self, job_id, kind: str, attempts: int, error: Exception = None):
+        due, data, attempts_key = self._job_keys
+        if error is None or attempts >= JOB_MAX_ATTEMPTS:
+            if error is not None:
+                logger.error(f"Vazifa {job_id} ({kind}) {attempts} urinishdan keyin tashlab yuborildi: {error}")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(due, job_id).hdel(data, job_id).hdel(attempts_key, job_id)
+                await pipe.execute()
+        else:
+            await self.redis.zadd(due, {job_id: time.time() + 30 * 2 ** attempts})
+
+    async def next_job_delay(self) -> float:
+        head = await self.redis.zrange(self._job_keys[0], 0, 0, withscores=True)
+        if not head:
+            return JOB_IDLE_SLEEP
+        return min(max(head[0][1] - time.time(), 0), JOB_IDLE_SLEEP)
+
+    async def snapshot(self):
+        return {"backend": self.name, "worker": WORKER_ID, "jobs": await self.redis.zcard(self._job_keys[0])}
+
+def db_scoped(name: str) -> str:
+    """Bazadagi obunachilar bilan ishlaydigan lease nomi – alohida bazali workerlar bir-birini toʻsmaydi."""
+    return f"db:{DB_ID}:{name}"
+
+def create_state_backend(url: str = STATE_BACKEND_URL):
+    if not url:
+        return LocalStateBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateBackend(url)
+    raise ValueError(f"Nomaʼlum STATE_BACKEND_URL: {url}")
+
+state_backend = create_state_backend()
+
 # ========== MATCH DATA FUNCTIONS ==========
-async def fetch_matches_by_league(league_code: str):
+async def fetch_matches_by_league(league_code: str, priority: int = PRIORITY_INTERACTIVE):
+    today = datetime.now().strftime("%Y-%m-%d")
+    entry = await load_league(league_code, today)
+    if entry:
+        now = time.time()
+        if now < entry["expires_at"]:
+            league_cache_stats["hit"] += 1
+            return {"success": entry["matches"], "keyboard": entry["keyboard"]}
+        if now - entry["expires_at"] < LEAGUE_CACHE_MAX_STALE:
+            # Eskirgan roʻyxat darhol qaytariladi, yangilanish fonda ketadi
+            league_cache_stats["stale"] += 1
+            refresh_league_in_background(league_code)
+            return {"success": entry["matches"], "keyboard": entry["keyboard"]}
+    league_cache_stats["miss"] += 1
+    return await refresh_league(league_code, priority)
+
+async def refresh_league(league_code: str, priority: int = PRIORITY_INTERACTIVE):
     today = datetime.now().strftime("%Y-%m-%d")
     end_date = (datetime.now() + timedelta(days=DAYS_AHEAD)).strftime("%Y-%m-%d")
     url = f"{FOOTBALL_DATA_URL}/matches"
     params = {"competitions": league_code, "dateFrom": today, "dateTo": end_date, "status": "SCHEDULED,LIVE,IN_PLAY,PAUSED,FINISHED"}
-    res = await rate_limited_api_call(url, HEADERS, params)
-    if "success" in res:
-        return {"success": res["success"].get("matches", [])}
-    return res
+    entry = league_cache.get(league_code)
+    etag = entry["etag"] if entry and entry["date_from"] == today else None
+    res = await rate_limited_api_call(url, HEADERS, params, priority, etag)
+    if "not_modified" in res:
+        matches = entry["matches"]
+    elif "success" in res:
+        matches = res["success"].get("matches", [])
+    else:
+        return res
+    entry = await store_league(league_code, matches, today, res.get("etag"))
+    return {"success": matches, "keyboard": entry["keyboard"]}
+
+def refresh_league_in_background(league_code: str):
+    if league_code in _league_refreshing:
+        return
+    _league_refreshing.add(league_code)
+
+    async def _run():
+        try:
+            res = await refresh_league(league_code, PRIORITY_BACKGROUND)
+            if "error" in res:
+                logger.warning(f"Liga keshini yangilab boʻlmadi ({league_code}): {res['error']}")
+        finally:
+            _league_refreshing.discard(league_code)
+
+    asyncio.create_task(_run())
 
-async def fetch_match_lineups(match_id: int):
-    match = await get_cached_match(match_id)
+async def fetch_match_lineups(match_id: int, priority: int = PRIORITY_INTERACTIVE):
+    return extract_lineups(await get_cached_match(match_id, priority, full=True))
+
+def extract_lineups(match):
     if not match:
         return None
     home = match.get("homeTeam", {})
@@ -359,43 +1731,40 @@ async def fetch_match_lineups(match_id: int):
         "home_formation": home.get("formation"),
         "away_formation": away.get("formation"),
         "venue": match.get("venue"),
-        "attendance": match.get("attendance")
+        "attendance": match.get("attendance"),
+        "last_updated": match.get("lastUpdated")
     }
 
-def format_lineups(data):
-    if not data or (not data['home_lineup'] and not data['away_lineup']):
-        return "📋 Tarkiblar hali e'lon qilinmagan."
-    msg = f"⚽ **{data['home_team']} vs {data['away_team']}**\n\n"
-    if data['venue']: msg += f"🏟️ Stadion: {data['venue']}\n"
-    if data['attendance']: msg += f"👥 Tomoshabin: {data['attendance']}\n"
-    msg += f"\n🏠 **{data['home_team']}**"
-    if data['home_formation']: msg += f" ({data['home_formation']})"
-    if data['home_coach']: msg += f" – Murabbiy: {data['home_coach']}"
-    msg += "\n" + "━" * 30 + "\n"
-    if data['home_lineup']:
-        for p in data['home_lineup'][:11]:
-            pos = p.get('position', '')
-            icon = "🥅" if "Goalkeeper" in pos else "🛡️" if "Defender" in pos else "⚡" if "Midfielder" in pos else "🎯"
-            shirt = p.get('shirtNumber', '')
-            name = p.get('name', "Noma'lum")
-            msg += f"{icon} {shirt} – {name} ({pos})\n"
-    else:
-        msg += "❌ Tarkib e'lon qilinmagan\n"
-    msg += f"\n🛣️ **{data['away_team']}**"
-    if data['away_formation']: msg += f" ({data['away_formation']})"
-    if data['away_coach']: msg += f" – Murabbiy: {data['away_coach']}"
-    msg += "\n" + "━" * 30 + "\n"
-    if data['away_lineup']:
-        for p in data['away_lineup'][:11]:
+LINEUP_SEPARATOR = "━" * 30
+
+def _position_icon(pos: str) -> str:
+    return "🥅" if "Goalkeeper" in pos else "🛡️" if "Defender" in pos else "⚡" if "Midfielder" in pos else "🎯"
+
+def _lineup_block(icon, team, formation, coach, lineup):
+    header = f"\n{icon} **{team}**"
+    if formation: header += f" ({formation})"
+    if coach: header += f" – Murabbiy: {coach}"
+    lines = [header, LINEUP_SEPARATOR]
+    if lineup:
+        for p in lineup[:11]:
             pos = p.get('position', '')
-            icon = "🥅" if "Goalkeeper" in pos else "🛡️" if "Defender" in pos else "⚡" if "Midfielder" in pos else "🎯"
-            shirt = p.get('shirtNumber', '')
             name = p.get('name', "Noma'lum")
-            msg += f"{icon} {shirt} – {name} ({pos})\n"
+            lines.append(f"{_position_icon(pos)} {p.get('shirtNumber', '')} – {name} ({pos})")
     else:
-        msg += "❌ Tarkib e'lon qilinmagan\n"
-    return msg
+        lines.append("❌ Tarkib e'lon qilinmagan")
+    return lines
 
+def format_lineups(data):
+    if not data or (not data['home_lineup'] and not data['away_lineup']):
+        return "📋 Tarkiblar hali e'lon qilinmagan."
+    lines = [f"⚽ **{data['home_team']} vs {data['away_team']}**", ""]
+    if data['venue']: lines.append(f"🏟️ Stadion: {data['venue']}")
+    if data['attendance']: lines.append(f"👥 Tomoshabin: {data['attendance']}")
+    lines += _lineup_block("🏠", data['home_team'], data['home_formation'], data['home_coach'], data['home_lineup'])
+    lines += _lineup_block("🛣️", data['away_team'], data['away_formation'], data['away_coach'], data['away_lineup'])
+    return "\n".join(lines) + "\n"
+
+@functools.lru_cache(maxsize=2048)
 def generate_match_links(mid, home, away, league):
     links = []
     links.append(("📺 ESPN", f"https://www.espn.com/soccer/match/_/gameId/{mid}"))
@@ -416,29 +1785,30 @@ def generate_match_links(mid, home, away, league):
         links.append(("📕 RMC Sport", f"https://rmcsport.bfmtv.com/football/match-{mid}.html"))
     links.append(("⚽ FlashScore", f"https://www.flashscore.com/match/{mid}/#/lineups"))
     links.append(("📊 SofaScore", f"https://www.sofascore.com/football/match/{mid}"))
-    return links
+    # lru_cache natijasi umumiy – oʻzgarmas tuple qaytariladi
+    return tuple(links)
 
 def format_links_message(links):
-    msg = "🔗 **Ishonchli saytlarda tarkiblarni ko‘ring:**\n\n"
-    for name, url in links[:5]:
-        msg += f"• [{name}]({url})\n"
-    return msg
+    return "🔗 **Ishonchli saytlarda tarkiblarni ko‘ring:**\n\n" + "".join(f"• [{name}]({url})\n" for name, url in links[:5])
 
 # ========== CHIROYLI TAHLIL SHABLONI (ITALIC + EMOJI) ==========
+MATCH_STATUS_TEXT = {
+    "SCHEDULED": "⏳ Kutilmoqda",
+    "TIMED": "⏳ Kutilmoqda",
+    "LIVE": "🟢 Jonli",
+    "IN_PLAY": "🟢 Jonli",
+    "PAUSED": "⏸️ Tanaffus",
+    "FINISHED": "✅ Yakunlangan",
+    "POSTPONED": "⏱️ Qoldirilgan",
+    "SUSPENDED": "⚠️ Toʻxtatilgan",
+    "CANCELLED": "❌ Bekor qilingan"
+}
+
 def format_analysis_message(match_id, home_team, away_team, match_time, match_status, analysis_text, added_date):
     """
     Tahlil matnini chiroyli, emoji va qiya (italic) shriftlar bilan formatlaydi.
     """
-    status_map = {
-        "SCHEDULED": "⏳ Kutilmoqda",
-        "LIVE": "🟢 Jonli",
-        "IN_PLAY": "🟢 Jonli",
-        "PAUSED": "⏸️ Tanaffus",
-        "FINISHED": "✅ Yakunlangan",
-        "POSTPONED": "⏱️ Qoldirilgan",
-        "CANCELLED": "❌ Bekor qilingan"
-    }
-    status_text = status_map.get(match_status, match_status)
+    status_text = MATCH_STATUS_TEXT.get(match_status, match_status)
     
     # Match vaqtini formatlash (Toshkent vaqti)
     try:
@@ -464,30 +1834,102 @@ def format_analysis_message(match_id, home_team, away_team, match_time, match_st
     )
     return msg
 
-# ========== INLINE KEYBOARDS ==========
-def money_row():
-    return [InlineKeyboardButton("💰 Pul ishlash", callback_data="money_info"),
-            InlineKeyboardButton("💳 Balans", callback_data="balance_info"),
-            InlineKeyboardButton("💸 Pul yechish", callback_data="withdraw_info")]
+# ========== RENDER CACHE ==========
+RENDER_CACHE_MAX_ENTRIES = int(os.environ.get("RENDER_CACHE_MAX_ENTRIES", 5000))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RENDER_CACHE_TTL = 6 * 3600
+
+render_cache = LRUCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+_render_generation = {}
+
+def invalidate_render(match_id: int):
+    """Tahlil oʻzgarganda oʻyinning barcha tayyor matnlari eskiradi (LRU oʻzi chiqarib yuboradi)."""
+    _render_generation[match_id] = _render_generation.get(match_id, 0) + 1
+
+def cached_render(kind: str, match_id: int, version, build):
+    """(kind, match_id, versiya) boʻyicha tayyor xabar matni; build() har bir versiya uchun bir marta chaqiriladi."""
+    key = (kind, match_id, _render_generation.get(match_id, 0), version)
+    text = render_cache.get(key)
+    if text is None:
+        text = build()
+        render_cache.set(key, text, RENDER_CACHE_TTL, size=len(text))
+    return text
+
+def lineups_version(data):
+    """API lastUpdated boʻlsa u, aks holda tarkib maʼlumotining hash'i."""
+    if not data:
+        return None
+    return data.get("last_updated") or content_hash(json.dumps(data, sort_keys=True, default=str))
+
+def render_analysis(match_id, home, away, match_time_str, match_status, analysis_row):
+    text, analysis_url, added_at = analysis_row
+    version = content_hash("\x1f".join(map(str, (home, away, match_time_str, match_status, text, added_at))))
+
+    def build():
+        added_date_str = datetime.strptime(added_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+        # Chiroyli shablon – italic va emoji
+        return format_analysis_message(match_id, home, away, match_time_str, match_status,
+                                       escape_markdown(text, version=2), added_date_str)
+
+    return cached_render("analysis", match_id, version, build)
+
+def render_lineups_view(match_id, match):
+    """lineups_ tugmasi uchun tarkib + havolalar matni."""
+    lineups = extract_lineups(match)
+    league = "PL"
+    home = away = "Noma'lum"
+    if match:
+        league = match.get("competition", {}).get("code", "PL")
+        home = match.get("homeTeam", {}).get("name", "Noma'lum")
+        away = match.get("awayTeam", {}).get("name", "Noma'lum")
 
-def get_leagues_keyboard():
-    kb = []
-    for code, data in TOP_LEAGUES.items():
-        kb.append([InlineKeyboardButton(data["name"], callback_data=f"league_{code}")])
-    kb.append(money_row())
-    return InlineKeyboardMarkup(kb)
+    def build():
+        if lineups and (lineups['home_lineup'] or lineups['away_lineup']):
+            msg = format_lineups(lineups)
+        else:
+            msg = "❌ Bu oʻyin uchun tarkiblar hali eʼlon qilinmagan."
+        return msg + "\n\n" + format_links_message(generate_match_links(match_id, home, away, league))
+
+    return cached_render("lineups_view", match_id, (lineups_version(lineups), home, away, league), build)
+
+# ========== INLINE KEYBOARDS ==========
+# Telegram obyektlari oʻzgarmas (frozen) – statik tugmalar bir marta quriladi va qayta ishlatiladi
+MATCH_DETAIL_KEYBOARD_CACHE = int(os.environ.get("MATCH_DETAIL_KEYBOARD_CACHE", 4096))
+
+MONEY_ROW = (InlineKeyboardButton("💰 Pul ishlash", callback_data="money_info"),
+             InlineKeyboardButton("💳 Balans", callback_data="balance_info"),
+             InlineKeyboardButton("💸 Pul yechish", callback_data="withdraw_info"))
+HOME_ROW = (InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start"),)
+BACK_TO_LEAGUES_ROW = (InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues"),)
+LINKS_ROW = (InlineKeyboardButton("📰 Futbol yangiliklari", url="https://t.me/ai_futinside"),
+             InlineKeyboardButton("📊 Chuqur tahlil", url="https://futbolinside.netlify.app/"),
+             InlineKeyboardButton("🎲 Stavka qilish", url="https://superlative-twilight-47ef34.netlify.app/"))
+
+LEAGUES_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(data["name"], callback_data=f"league_{code}")] for code, data in TOP_LEAGUES.items()]
+    + [MONEY_ROW])
+HOME_KEYBOARD = InlineKeyboardMarkup([HOME_ROW, MONEY_ROW])
+
+@functools.lru_cache(maxsize=4096)
+def local_kickoff(utc_date: str) -> datetime:
+    """API UTC vaqtini Toshkent vaqtiga oʻtkazadi (natija keshlanadi)."""
+    return datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
+
+def fixture_label(m) -> str:
+    return f"{m['homeTeam']['name']} – {m['awayTeam']['name']} ({local_kickoff(m['utcDate']).strftime('%d.%m %H:%M')})"
 
 def build_matches_keyboard(matches):
-    kb = []
-    for m in matches[:10]:
-        date_obj = datetime.strptime(m["utcDate"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
-        date_str = date_obj.strftime("%d.%m %H:%M")
-        kb.append([InlineKeyboardButton(f"{m['homeTeam']['name']} – {m['awayTeam']['name']} ({date_str})", callback_data=f"match_{m['id']}")])
-    kb.append([InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues")])
-    kb.append(money_row())
+    """Liga roʻyxati klaviaturasi – maʼlumot saqlanganda bir marta quriladi (store_league/load_league)."""
+    kb = [[InlineKeyboardButton(fixture_label(m), callback_data=f"match_{m['id']}")] for m in matches[:10]]
+    kb.append(BACK_TO_LEAGUES_ROW)
+    kb.append(MONEY_ROW)
     return InlineKeyboardMarkup(kb)
 
 def build_match_detail_keyboard(mid, is_subscribed=False, lineups_available=False, analysis_url=None):
+    return _match_detail_keyboard(int(mid), bool(is_subscribed), bool(lineups_available), analysis_url)
+
+@functools.lru_cache(maxsize=MATCH_DETAIL_KEYBOARD_CACHE)
+def _match_detail_keyboard(mid, is_subscribed, lineups_available, analysis_url):
     kb = []
     if is_subscribed:
         kb.append([InlineKeyboardButton("🔕 Kuzatishni bekor qilish", callback_data=f"unsubscribe_{mid}")])
@@ -495,15 +1937,101 @@ def build_match_detail_keyboard(mid, is_subscribed=False, lineups_available=Fals
         kb.append([InlineKeyboardButton("🔔 Kuzatish", callback_data=f"subscribe_{mid}")])
     if analysis_url:
         kb.append([InlineKeyboardButton("🔗 To‘liq tahlil", url=analysis_url)])
-    kb.append([InlineKeyboardButton("📰 Futbol yangiliklari", url="https://t.me/ai_futinside"),
-               InlineKeyboardButton("📊 Chuqur tahlil", url="https://futbolinside.netlify.app/"),
-               InlineKeyboardButton("🎲 Stavka qilish", url="https://superlative-twilight-47ef34.netlify.app/")])
+    kb.append(LINKS_ROW)
     if lineups_available:
         kb.append([InlineKeyboardButton("📋 Tarkiblarni ko‘rish", callback_data=f"lineups_{mid}")])
-    kb.append([InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues")])
-    kb.append(money_row())
+    kb.append(BACK_TO_LEAGUES_ROW)
+    kb.append(MONEY_ROW)
     return InlineKeyboardMarkup(kb)
 
+@functools.lru_cache(maxsize=MATCH_DETAIL_KEYBOARD_CACHE)
+def build_lineups_keyboard(mid):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 Oʻyinga qaytish", callback_data=f"match_{mid}")],
+        BACK_TO_LEAGUES_ROW,
+        MONEY_ROW])
+
+# ========== MATCH DETAIL LOADER ==========
+STAGE_TIMING_SAMPLES = int(os.environ.get("STAGE_TIMING_SAMPLES", 1000))
+
+class StageTimings:
+    """Har bir bosqich uchun oxirgi N ta davomiylik (ms) – avg va p95 hisoblash uchun."""
+
+    def __init__(self, samples: int = STAGE_TIMING_SAMPLES):
+        self.samples = samples
+        self._data = {}
+
+    def record(self, stage: str, seconds: float):
+        buf = self._data.get(stage)
+        if buf is None:
+            buf = self._data[stage] = deque(maxlen=self.samples)
+        buf.append(seconds * 1000)
+
+    @asynccontextmanager
+    async def measure(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started)
+
+    def snapshot(self):
+        out = {}
+        for stage, buf in self._data.items():
+            values = sorted(buf)
+            out[stage] = {"count": len(values), "avg_ms": round(sum(values) / len(values), 1),
+                          "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1)}
+        return out
+
+match_detail_timings = StageTimings()
+
+async def _timed(stage: str, coro):
+    async with match_detail_timings.measure(stage):
+        return await coro
+
+async def load_match_detail(match_id: int, user_id: int):
+    """Tahlil, oʻyin maʼlumoti va obuna holatini parallel yuklaydi."""
+    async with match_detail_timings.measure("load"):
+        return await asyncio.gather(
+            _timed("analysis", get_analysis(match_id)),
+            _timed("match", get_cached_match(match_id)),
+            _timed("subscription", is_subscribed(user_id, match_id)))
+
+# ========== MESSAGE EDITS ==========
+EDIT_HASH_CACHE = int(os.environ.get("EDIT_HASH_CACHE", 20000))
+EDIT_HASH_TTL = 48 * 3600
+
+def content_hash(text: str, reply_markup=None) -> str:
+    h = hashlib.blake2b(text.encode(), digest_size=12)
+    if reply_markup is not None:
+        h.update(reply_markup.to_json().encode())
+    return h.hexdigest()
+
+def is_not_modified(error: BadRequest) -> bool:
+    return "message is not modified" in str(error).lower()
+
+# (chat_id, message_id) -> oxirgi yozilgan kontent hash; bir xil tahrir Telegram'ga yuborilmaydi.
+# Mahalliy backendda shu LRU, Redis bilan – umumiy kalitlar (boshqa worker tahriri ham koʻrinadi)
+message_hashes = LRUCache(EDIT_HASH_CACHE, EDIT_HASH_CACHE * 24)
+
+async def edit_if_changed(q, text: str, reply_markup=None, **kwargs) -> bool:
+    """Callback xabarini tahrirlaydi; kontent oʻzgarmagan boʻlsa soʻrov yuborilmaydi."""
+    chat_id, message_id = q.message.chat_id, q.message.message_id
+    digest = content_hash(text, reply_markup)
+    if await state_backend.get_message_hash(chat_id, message_id) == digest:
+        return False
+    try:
+        await q.edit_message_text(text, reply_markup=reply_markup, **kwargs)
+    except BadRequest as e:
+        if not is_not_modified(e):
+            raise
+    await state_backend.set_message_hash(chat_id, message_id, digest)
+    return True
+
+async def forget_message(q):
+    """Xabar boshqa yoʻl bilan (masalan faqat klaviatura) oʻzgarganda hash unutiladi."""
+    await state_backend.forget_message_hash(q.message.chat_id, q.message.message_id)
+
 # ========== HANDLERS ==========
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
@@ -513,10 +2041,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try: ref = int(args[0].replace("ref_", ""))
         except: pass
         if ref == u.id: ref = None
-    await get_or_create_user(u.id, ref, context.bot, u.first_name)
+    await get_or_create_user(u.id, ref, u.first_name)
     await schedule_aisports_bonus(u.id, context)
-    bot_username = (await context.bot.get_me()).username
-    ref_link = await get_referral_link(u.id, bot_username)
+    ref_link = get_referral_link(u.id)
     text = (f"👋 Assalomu alaykum, {u.first_name}!\n\n⚽ Ushbu bot orqali top 5 chempionat oʻyinlarini kuzatishingiz, "
             f"tahlillarni olishingiz va oʻyinlar haqida eslatmalarni sozlashingiz mumkin.\n\n"
             f"💰 **Pul ishlash imkoniyati**:\nDoʻstlaringizni taklif qiling va har bir taklif uchun **{REFERRAL_BONUS:,} soʻm** oling!\n"
@@ -524,8 +2051,36 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"💸 Minimal pul yechish: **{MIN_WITHDRAW:,} soʻm**, kuniga **1 marta**.\n\n"
             f"🎁 **Aisports maxsus sovgʻasi**: 30 000 soʻm bonus puli 1-2 daqiqadan soʻng hisobingizga qoʻshiladi!\n\n"
             f"Quyida ligalardan birini tanlang:")
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=get_leagues_keyboard())
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=LEAGUES_KEYBOARD)
+
+CALLBACK_ACTIONS = {"money_info", "balance_info", "withdraw_info", "back_to_start", "leagues"}
+CALLBACK_PREFIXES = ("league_", "match_", "lineups_", "subscribe_", "unsubscribe_")
+
+def callback_action(data: str) -> str:
+    """callback_data dan metrika label: prefiks yoki maʼlum amal, qolgani "other"."""
+    if data in CALLBACK_ACTIONS:
+        return data
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix[:-1]
+    return "other"
+
+def observe_callback(fn):
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        action = callback_action(update.callback_query.data or "")
+        started = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except Exception:
+            CALLBACK_ERRORS.inc(action)
+            raise
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - started, action)
 
+    return wrapper
+
+@observe_callback
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -533,10 +2088,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
 
     if data == "money_info":
-        bot_username = (await context.bot.get_me()).username
-        ref_link = await get_referral_link(uid, bot_username)
-        stats = await get_referral_stats(uid)
-        bal = await get_user_balance(uid)
+        ref_link = get_referral_link(uid)
+        stats = await get_user_profile(uid)
+        bal = stats["balance"]
         text = (f"💰 **Pul ishlash tizimi**\n\n• Har bir doʻstingizni taklif qilish uchun: **+{REFERRAL_BONUS:,} soʻm**\n"
                 f"• Minimal pul yechish: **{MIN_WITHDRAW:,} soʻm**\n• Kuniga **1 marta** pul yechish mumkin.\n\n"
                 f"📊 **Sizning statistika:**\n• Balans: **{bal:,} soʻm**\n• Taklif qilinganlar: **{stats['count']} ta**\n"
@@ -547,85 +2101,72 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                       f"🎁 Har bir taklif uchun +{REFERRAL_BONUS:,} soʻm bonus!\n👇 Quyidagi havola orqali botga oʻting:\n{ref_link}")
         share_url = f"https://t.me/share/url?url={quote(ref_link)}&text={quote(share_text)}"
         kb = [[InlineKeyboardButton("📤 Do'stlarga yuborish", url=share_url)],
-              [InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")],
-              money_row()]
+              HOME_ROW,
+              MONEY_ROW]
         await q.message.reply_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
         return
 
     if data == "balance_info":
-        bal = await get_user_balance(uid)
-        stats = await get_referral_stats(uid)
+        stats = await get_user_profile(uid)
+        bal = stats["balance"]
         text = (f"💳 **Sizning balansingiz**\n\n💰 Balans: **{bal:,} soʻm**\n👥 Referallar: **{stats['count']} ta**\n"
                 f"🎁 Bonus: **{stats['total_bonus']:,} soʻm**\n\n💸 Pul yechish uchun minimal miqdor: **{MIN_WITHDRAW:,} soʻm**\n📅 Kuniga **1 marta** yechish mumkin.")
-        kb = [[InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")], money_row()]
-        await q.message.reply_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
+        await q.message.reply_text(text, parse_mode="Markdown", reply_markup=HOME_KEYBOARD)
         return
 
     if data == "withdraw_info":
-        bal = await get_user_balance(uid)
-        if bal < MIN_WITHDRAW:
-            text = f"❌ Sizda yetarli mablagʻ yoʻq.\nBalans: **{bal:,} soʻm**\nMinimal yechish: **{MIN_WITHDRAW:,} soʻm**\n\nDoʻstlaringizni taklif qilib pul ishlang!"
-            kb = [[InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")], money_row()]
-            await q.message.reply_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
-            return
-        can, msg = await can_withdraw(uid)
-        if not can:
-            kb = [[InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")], money_row()]
-            await q.message.reply_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
-            return
-        success = await register_withdraw(uid, MIN_WITHDRAW)
+        success, result = await register_withdraw(uid, MIN_WITHDRAW)
         if success:
             kb = [[InlineKeyboardButton("💸 Pul yechish (test)", url="https://futbolinsidepulyechish.netlify.app/")],
-                  [InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")], money_row()]
+                  HOME_ROW, MONEY_ROW]
             await q.message.reply_text(
-                f"✅ **Pul yechish soʻrovingiz qabul qilindi!**\n\nYechilgan miqdor: **{MIN_WITHDRAW:,} soʻm**\nQolgan balans: **{bal - MIN_WITHDRAW:,} soʻm**\n\n⚠️ Bu test rejimi. Pul yechish uchun quyidagi havolaga oʻting:",
+                f"✅ **Pul yechish soʻrovingiz qabul qilindi!**\n\nYechilgan miqdor: **{MIN_WITHDRAW:,} soʻm**\nQolgan balans: **{result:,} soʻm**\n\n⚠️ Bu test rejimi. Pul yechish uchun quyidagi havolaga oʻting:",
                 parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
         else:
-            kb = [[InlineKeyboardButton("🏠 Bosh menyu", callback_data="back_to_start")], money_row()]
-            await q.message.reply_text("❌ Xatolik yuz berdi. Qayta urinib koʻring.", reply_markup=InlineKeyboardMarkup(kb))
+            await q.message.reply_text(result, parse_mode="Markdown", reply_markup=HOME_KEYBOARD)
         return
 
     if data == "back_to_start":
         u = update.effective_user
         await get_or_create_user(u.id, None)
-        bot_username = (await context.bot.get_me()).username
-        ref_link = await get_referral_link(u.id, bot_username)
+        ref_link = get_referral_link(u.id)
         text = (f"👋 Assalomu alaykum, {u.first_name}!\n\n⚽ Ushbu bot orqali top 5 chempionat oʻyinlarini kuzatishingiz, "
                 f"tahlillarni olishingiz va oʻyinlar haqida eslatmalarni sozlashingiz mumkin.\n\n"
                 f"💰 **Pul ishlash imkoniyati**:\nDoʻstlaringizni taklif qiling va har bir taklif uchun **{REFERRAL_BONUS:,} soʻm** oling!\n"
                 f"Sizning referal havolangiz:\n`{ref_link}`\n\n"
                 f"💸 Minimal pul yechish: **{MIN_WITHDRAW:,} soʻm**, kuniga **1 marta**.\n\nQuyida ligalardan birini tanlang:")
-        await q.message.reply_text(text, parse_mode="Markdown", reply_markup=get_leagues_keyboard())
+        await q.message.reply_text(text, parse_mode="Markdown", reply_markup=LEAGUES_KEYBOARD)
         return
 
     if data == "leagues":
-        await q.edit_message_text("sport uchun eng yuqori sifatdagi taxlilarni olish uchun Quyidagi chempionatlardan birini tanlang:",
-                                  reply_markup=get_leagues_keyboard())
+        await edit_if_changed(q, "sport uchun eng yuqori sifatdagi taxlilarni olish uchun Quyidagi chempionatlardan birini tanlang:",
+                                  reply_markup=LEAGUES_KEYBOARD)
         return
 
     if data.startswith("league_"):
         code = data.split("_")[1]
         info = TOP_LEAGUES.get(code)
         if not info:
-            await q.edit_message_text("❌ Notoʻgʻri tanlov.")
+            await edit_if_changed(q, "❌ Notoʻgʻri tanlov.")
             return
-        await q.edit_message_text(f"⏳ {info['name']} – oʻyinlar yuklanmoqda...")
+        await edit_if_changed(q, f"⏳ {info['name']} – oʻyinlar yuklanmoqda...")
         res = await fetch_matches_by_league(code)
         if "error" in res:
-            await q.edit_message_text(res["error"], reply_markup=get_leagues_keyboard())
+            await edit_if_changed(q, res["error"], reply_markup=LEAGUES_KEYBOARD)
             return
         matches = res["success"]
         if not matches:
-            await q.edit_message_text(f"⚽ {info['name']}\n{DAYS_AHEAD} kun ichida oʻyinlar yoʻq.", reply_markup=get_leagues_keyboard())
+            await edit_if_changed(q, f"⚽ {info['name']}\n{DAYS_AHEAD} kun ichida oʻyinlar yoʻq.", reply_markup=LEAGUES_KEYBOARD)
             return
-        await q.edit_message_text(f"🏆 **{info['name']}** – {DAYS_AHEAD} kun ichidagi oʻyinlar:\n\nOʻyin ustiga bosing, tahlil va kuzatish imkoniyati.",
-                                  parse_mode="Markdown", reply_markup=build_matches_keyboard(matches))
+        await edit_if_changed(q, f"🏆 **{info['name']}** – {DAYS_AHEAD} kun ichidagi oʻyinlar:\n\nOʻyin ustiga bosing, tahlil va kuzatish imkoniyati.",
+                                  parse_mode="Markdown", reply_markup=res["keyboard"])
         return
 
     if data.startswith("match_"):
         mid = int(data.split("_")[1])
-        analysis_row = await get_analysis(mid)
-        match = await get_cached_match(mid)
+        started = time.monotonic()
+        analysis_row, match, subscribed = await load_match_detail(mid, uid)
+        rendering = time.monotonic()
         league = "PL"
         home = away = "Noma'lum"
         match_status = "SCHEDULED"
@@ -637,8 +2178,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             match_status = match.get("status", "SCHEDULED")
             utc_date = match.get("utcDate", "")
             if utc_date:
-                dt = datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
-                match_time_str = dt.strftime("%d.%m.%Y %H:%M")
+                match_time_str = local_kickoff(utc_date).strftime("%d.%m.%Y %H:%M")
             else:
                 match_time_str = "Vaqt noma'lum"
         else:
@@ -646,57 +2186,38 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         analysis_url = None
         if analysis_row:
-            text, analysis_url, added_at = analysis_row
-            added_at_dt = datetime.strptime(added_at, "%Y-%m-%d %H:%M:%S")
-            added_date_str = added_at_dt.strftime("%d.%m.%Y %H:%M")
-            safe_text = escape_markdown(text, version=2)
-            # Chiroyli shablon – italic va emoji
-            msg = format_analysis_message(
-                mid, home, away, match_time_str, match_status,
-                safe_text, added_date_str
-            )
+            analysis_url = analysis_row[1]
+            msg = render_analysis(mid, home, away, match_time_str, match_status, analysis_row)
         else:
             msg = f"⚽ **Oʻyin tahlili**\n\n🆔 Match ID: `{mid}`\n📊 Hozircha tahlil mavjud emas."
-            if await is_admin(uid):
+            if is_admin(uid):
                 msg += f"\n\n💡 Admin: `/addanalysis {mid} <tahlil>`"
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (uid, mid)) as cur:
-                subscribed = await cur.fetchone() is not None
-
-        lineups = await fetch_match_lineups(mid)
+        # Tarkiblar oʻsha match obyektidan olinadi – qayta soʻrov yoʻq
+        lineups = extract_lineups(match)
         lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
+        if match and not has_full_details(match):
+            # Roʻyxatdan kelgan qisqa yozuv: tarkib tugmasi boshlanishga yaqin qolganda koʻrsatiladi
+            lineups_avail = match_status in LIVE_STATUSES or match_status == "FINISHED" or (
+                match.get("utcDate", "") <= (datetime.utcnow() + timedelta(minutes=LINEUPS_WINDOW)).strftime("%Y-%m-%dT%H:%M:%SZ"))
         kb = build_match_detail_keyboard(mid, subscribed, lineups_avail, analysis_url)
+        match_detail_timings.record("render", time.monotonic() - rendering)
 
-        if len(msg) > 4096:
-            await q.edit_message_text(msg[:4090] + "...", parse_mode="Markdown", reply_markup=kb)
-            await context.bot.send_message(uid, f"📎 **Tahlilning davomi:**\n\n{msg[4090:]}", parse_mode="Markdown")
-        else:
-            await q.edit_message_text(msg, parse_mode="Markdown", reply_markup=kb)
+        async with match_detail_timings.measure("send"):
+            if len(msg) > 4096:
+                await edit_if_changed(q, msg[:4090] + "...", parse_mode="Markdown", reply_markup=kb)
+                await context.bot.send_message(uid, f"📎 **Tahlilning davomi:**\n\n{msg[4090:]}", parse_mode="Markdown")
+            else:
+                await edit_if_changed(q, msg, parse_mode="Markdown", reply_markup=kb)
+        match_detail_timings.record("total", time.monotonic() - started)
         return
 
     if data.startswith("lineups_"):
         mid = int(data.split("_")[1])
-        await q.edit_message_text("⏳ Tarkiblar yuklanmoqda...")
-        lineups = await fetch_match_lineups(mid)
-        if lineups and (lineups['home_lineup'] or lineups['away_lineup']):
-            msg = format_lineups(lineups)
-        else:
-            msg = "❌ Bu oʻyin uchun tarkiblar hali eʼlon qilinmagan."
-        match = await get_cached_match(mid)
-        league = "PL"
-        home = away = "Noma'lum"
-        if match:
-            league = match.get("competition", {}).get("code", "PL")
-            home = match.get("homeTeam", {}).get("name", "Noma'lum")
-            away = match.get("awayTeam", {}).get("name", "Noma'lum")
-        links = generate_match_links(mid, home, away, league)
-        msg += "\n\n" + format_links_message(links)
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔙 Oʻyinga qaytish", callback_data=f"match_{mid}")],
-            [InlineKeyboardButton("🔙 Back to Leagues", callback_data="leagues")],
-            money_row()])
-        await q.edit_message_text(msg, parse_mode="Markdown", reply_markup=kb)
+        await edit_if_changed(q, "⏳ Tarkiblar yuklanmoqda...")
+        match = await get_cached_match(mid, full=True)
+        msg = render_lineups_view(mid, match)
+        await edit_if_changed(q, msg, parse_mode="Markdown", reply_markup=build_lineups_keyboard(mid))
         return
 
     if data.startswith("subscribe_"):
@@ -709,99 +2230,524 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         away = match["awayTeam"]["name"]
         t = match["utcDate"]
         league = match.get("competition", {}).get("code", "PL")
-        await subscribe_user(uid, mid, t, home, away, league)
-        analysis_row = await get_analysis(mid)
+        _, analysis_row = await asyncio.gather(subscribe_user(uid, mid, t, home, away, league), get_analysis(mid))
         analysis_url = analysis_row[1] if analysis_row else None
         new_kb = build_match_detail_keyboard(mid, is_subscribed=True, analysis_url=analysis_url)
+        await forget_message(q)
         await q.edit_message_reply_markup(reply_markup=new_kb)
         await q.answer("✅ Kuzatish boshlandi!", show_alert=False)
         return
 
     if data.startswith("unsubscribe_"):
         mid = int(data.split("_")[1])
-        await unsubscribe_user(uid, mid)
-        analysis_row = await get_analysis(mid)
+        _, analysis_row = await asyncio.gather(unsubscribe_user(uid, mid), get_analysis(mid))
         analysis_url = analysis_row[1] if analysis_row else None
         new_kb = build_match_detail_keyboard(mid, is_subscribed=False, analysis_url=analysis_url)
+        await forget_message(q)
         await q.edit_message_reply_markup(reply_markup=new_kb)
         await q.answer("❌ Kuzatish bekor qilindi", show_alert=False)
         return
 
+# ========== BROADCAST ==========
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 20))
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_MAX_RETRIES = 3
+
+# Telegram umumiy limiti ~30 xabar/s; interaktiv javoblar uchun zaxira qoldiriladi
+telegram_limiter = TokenBucket(BROADCAST_RATE, per=1.0)
+
+async def _telegram_call(call):
+    """Bitta Telegram soʻrovi: umumiy limiter, flood-wait va vaqtinchalik xatolarda qayta urinish.
+    Forbidden/BadRequest darhol chaqiruvchiga uzatiladi."""
+    for attempt in range(BROADCAST_MAX_RETRIES):
+        await telegram_limiter.acquire(PRIORITY_BACKGROUND)
+        try:
+            return await call()
+        except RetryAfter as e:
+            wait = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            logger.warning(f"Telegram flood limiti: {wait} s kutilmoqda")
+            telegram_limiter.pause(wait)
+            error = e
+        except (Forbidden, BadRequest):
+            raise
+        except Exception as e:
+            logger.error(f"Telegram soʻrovi xatosi (urinish {attempt+1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+            error = e
+    raise error
+
+async def _deliver(bot, chat_id: int, messages) -> bool:
+    for i, kwargs in enumerate(messages):
+        if i:
+            await asyncio.sleep(BROADCAST_CHAT_INTERVAL)
+        try:
+            await _telegram_call(lambda: bot.send_message(chat_id, **kwargs))
+        except Exception as e:
+            logger.error(f"Xabar yuborilmadi (user {chat_id}): {e}")
+            return False
+    return True
+
+async def broadcast(bot, chat_ids, messages, on_delivered=None, on_progress=None, label: str = "broadcast",
+                    deliver=_deliver):
+    """
+    Har bir chatga messages (send_message kwargs roʻyxati) ni cheklangan ishchilar puli orqali yuboradi.
+    deliver(bot, chat_id, messages) -> bool almashtirilishi mumkin (masalan jonli xabarni tahrirlash).
+    """
+    chat_ids = list(chat_ids)
+    stats = {"label": label, "total": len(chat_ids), "sent": 0, "failed": 0}
+    started = time.monotonic()
+    for offset in range(0, len(chat_ids), BROADCAST_BATCH_SIZE):
+        queue = asyncio.Queue()
+        for chat_id in chat_ids[offset:offset + BROADCAST_BATCH_SIZE]:
+            queue.put_nowait(chat_id)
+
+        async def worker():
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                if await deliver(bot, chat_id, messages):
+                    stats["sent"] += 1
+                    BROADCAST_MESSAGES.inc("sent")
+                    if on_delivered:
+                        await on_delivered(chat_id)
+                else:
+                    stats["failed"] += 1
+                    BROADCAST_MESSAGES.inc("failed")
+
+        await asyncio.gather(*(worker() for _ in range(min(BROADCAST_WORKERS, queue.qsize()))))
+        stats["elapsed"] = time.monotonic() - started
+        stats["rate"] = stats["sent"] / stats["elapsed"] if stats["elapsed"] else 0.0
+        if on_progress:
+            await on_progress(stats)
+        elif offset + BROADCAST_BATCH_SIZE < len(chat_ids):
+            logger.info(f"[{label}] {stats['sent'] + stats['failed']}/{stats['total']} yuborildi ({stats['rate']:.1f} xabar/s)")
+    stats.setdefault("elapsed", 0.0)
+    stats.setdefault("rate", 0.0)
+    logger.info(f"[{label}] yakunlandi: {stats['sent']} ta yuborildi, {stats['failed']} ta xato, "
+                f"{stats['elapsed']:.1f} s, {stats['rate']:.1f} xabar/s")
+    return stats
+
+def broadcast_in_background(bot, chat_ids, messages, admin_id: int = None, **kwargs):
+    """Broadcastni fonda ishga tushiradi; admin_id berilsa yakunda unga hisobot yuboriladi."""
+
+    async def _run():
+        stats = await broadcast(bot, chat_ids, messages, **kwargs)
+        if admin_id:
+            await bot.send_message(admin_id, f"📢 {stats['sent']} ta obunachiga bildirishnoma yuborildi.")
+
+    task = asyncio.create_task(_run())
+    task.add_done_callback(_log_task_error)
+    return task
+
 # ========== NOTIFICATION SCHEDULER ==========
+NOTIFICATION_OFFSETS = {"1h": 60, "15m": 15}
+NOTIFICATION_FLAGS = {"1h": "notified_1h", "15m": "notified_15m"}
+NOTIFY_GRACE = 5 * 60
+NOTIFICATION_RESYNC_INTERVAL = int(os.environ.get("NOTIFICATION_RESYNC_INTERVAL", 60))
+
+class NotificationQueue:
+    """(fire_time, match_id, kind) heap: scheduler faqat navbatdagi hodisa vaqtigacha uxlaydi."""
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def schedule_match(self, match_id: int, kickoff: datetime, kinds=NOTIFICATION_OFFSETS):
+        expired = datetime.utcnow() - timedelta(seconds=NOTIFY_GRACE)
+        for kind in kinds:
+            fire_time = kickoff - timedelta(minutes=NOTIFICATION_OFFSETS[kind])
+            if fire_time < expired or self._scheduled.get((match_id, kind)) == fire_time:
+                continue
+            self._scheduled[(match_id, kind)] = fire_time
+            heapq.heappush(self._heap, (fire_time, match_id, kind))
+            if self._heap[0] == (fire_time, match_id, kind):
+                self._wakeup.set()
+
+    def discard_match(self, match_id: int):
+        # Heap dan darhol oʻchirilmaydi – eskirgan yozuv navbati kelganda tashlab yuboriladi
+        for kind in NOTIFICATION_OFFSETS:
+            self._scheduled.pop((match_id, kind), None)
+
+    def _peek(self):
+        while self._heap:
+            fire_time, match_id, kind = self._heap[0]
+            if self._scheduled.get((match_id, kind)) == fire_time:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+    async def next_due(self):
+        while True:
+            head = self._peek()
+            now = datetime.utcnow()
+            if head and head[0] <= now:
+                heapq.heappop(self._heap)
+                del self._scheduled[(head[1], head[2])]
+                return head
+            timeout = (head[0] - now).total_seconds() if head else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+notification_queue = NotificationQueue()
+
+async def send_match_notification(app: Application, mid: int, kind: str, fire_time: datetime):
+    late = (datetime.utcnow() - fire_time).total_seconds()
+    if late > NOTIFY_GRACE:
+        logger.info(f"Kechikkan bildirishnoma tashlab yuborildi: match {mid}, {kind}, {int(late)} s")
+        return
+    # Har bir worker oʻz navbatidan ishga tushadi – hodisani faqat lease olgani yuboradi
+    if not await state_backend.acquire_lease(db_scoped(f"notify:{mid}:{kind}"), NOTIFY_GRACE * 2):
+        return
+    subs = await claim_subscribers(mid, NOTIFICATION_FLAGS[kind])
+    if not subs:
+        return
+    _, home, away, league, tstr = subs[0]
+    kickoff = datetime.strptime(tstr, "%Y-%m-%dT%H:%M:%SZ")
+    links = generate_match_links(mid, home, away, league)
+    if kind == "1h":
+        msg = f"⏰ **1 soat qoldi!**\n\n{home} – {away}\n🕒 {kickoff.strftime('%d.%m.%Y %H:%M')} UTC+0\n\n📋 Tarkiblar eʼlon qilinishi kutilmoqda."
+        await broadcast(app.bot, [uid for uid, *_ in subs], [{"text": msg, "parse_mode": "Markdown"}],
+                        on_delivered=lambda uid: update_notification_flags(uid, mid, one_hour=True), label=f"1h:{mid}")
+        await flag_batcher.flush()
+        lineup_users = [uid for uid, *_ in await claim_subscribers(mid, "notified_lineups")]
+        if not lineup_users:
+            return
+        lu = await fetch_match_lineups(mid, PRIORITY_BACKGROUND)
+        if lu and (lu['home_lineup'] or lu['away_lineup']):
+            messages = [{"text": cached_render("lineups", mid, lineups_version(lu), lambda: format_lineups(lu)),
+                         "parse_mode": "Markdown"},
+                        {"text": format_links_message(links), "parse_mode": "Markdown", "disable_web_page_preview": True}]
+        else:
+            msg = f"📋 **{home} – {away}**\n\n❌ Tarkiblar API orqali e'lon qilinmagan.\n🔗 Quyidagi ishonchli saytlarda tarkiblarni ko‘ring:\n\n"
+            for name, url in links[:4]:
+                msg += f"• [{name}]({url})\n"
+            messages = [{"text": msg, "parse_mode": "Markdown", "disable_web_page_preview": True}]
+        await broadcast(app.bot, lineup_users, messages,
+                        on_delivered=lambda uid: update_notification_flags(uid, mid, lineups=True), label=f"lineups:{mid}")
+        await flag_batcher.flush()
+    elif kind == "15m":
+        msg = f"⏳ **15 daqiqa qoldi!**\n\n{home} – {away}\n🕒 {kickoff.strftime('%d.%m.%Y %H:%M')} UTC+0\n\n🔗 Jonli tarkiblar va statistika:\n\n"
+        for name, url in links[:5]:
+            msg += f"• [{name}]({url})\n"
+        await broadcast(app.bot, [uid for uid, *_ in subs],
+                        [{"text": msg, "parse_mode": "Markdown", "disable_web_page_preview": True}],
+                        on_delivered=lambda uid: update_notification_flags(uid, mid, fifteen_min=True), label=f"15m:{mid}")
+        await flag_batcher.flush()
+
+async def _observed_notification(app: Application, mid: int, kind: str, fire_time: datetime):
+    with NOTIFICATION_SECONDS.time(kind):
+        await send_match_notification(app, mid, kind, fire_time)
+
+async def reload_pending_notifications():
+    """Navbatni bazadan toʻldiradi: boshqa workerda qilingan obunalar ham shu worker navbatiga tushadi."""
+    for mid, tstr, kinds in await get_pending_notification_matches():
+        notification_queue.schedule_match(mid, datetime.strptime(tstr, "%Y-%m-%dT%H:%M:%SZ"), kinds)
+
+async def notification_resyncer():
+    # Obunani qabul qilgan worker oʻchsa ham eslatma yoʻqolmaydi – har bir worker uni oʻz navbatiga oladi,
+    # yuborishni esa notify: lease egasi bajaradi
+    while True:
+        await asyncio.sleep(NOTIFICATION_RESYNC_INTERVAL)
+        try:
+            await reload_pending_notifications()
+        except Exception as e:
+            logger.exception(f"Bildirishnoma navbatini yangilash xatosi: {e}")
+
 async def notification_scheduler(app: Application):
+    await reload_pending_notifications()
+    logger.info(f"Bildirishnoma navbati tiklandi: {len(notification_queue)} ta hodisa")
+    asyncio.create_task(notification_resyncer()).add_done_callback(_log_task_error)
     while True:
         try:
-            subs = await get_all_subscriptions()
-            groups = {}
-            for s in subs:
-                uid, mid, tstr, home, away, league, n1, n15, nl = s
-                if mid not in groups:
-                    groups[mid] = {"time": datetime.strptime(tstr, "%Y-%m-%dT%H:%M:%SZ"), "home": home, "away": away, "league": league,
-                                   "users": [], "n1_flag": False, "n15_flag": False, "nl_flag": False}
-                groups[mid]["users"].append({"id": uid, "n1": n1, "n15": n15, "nl": nl})
-            for mid, g in groups.items():
-                delta = (g["time"] - datetime.utcnow()).total_seconds() / 60
-                if not g["n1_flag"] and any(not u["n1"] for u in g["users"]):
-                    if 55 <= delta <= 65:
-                        for u in g["users"]:
-                            if not u["n1"]:
-                                try:
-                                    await app.bot.send_message(u["id"],
-                                        f"⏰ **1 soat qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n📋 Tarkiblar eʼlon qilinishi kutilmoqda.",
-                                        parse_mode="Markdown")
-                                    await update_notification_flags(u["id"], mid, one_hour=True)
-                                except Exception as e:
-                                    logger.error(f"1h notification error: {e}")
-                        g["n1_flag"] = True
-                        if not g["nl_flag"] and any(not u["nl"] for u in g["users"]):
-                            lu = await fetch_match_lineups(mid)
-                            if lu and (lu['home_lineup'] or lu['away_lineup']):
-                                lineup_msg = format_lineups(lu)
-                                links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                                links_msg = format_links_message(links)
-                                for u in g["users"]:
-                                    if not u["nl"]:
-                                        try:
-                                            await app.bot.send_message(u["id"], lineup_msg, parse_mode="Markdown")
-                                            await app.bot.send_message(u["id"], links_msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                            await update_notification_flags(u["id"], mid, lineups=True)
-                                        except Exception as e:
-                                            logger.error(f"Lineups notification error: {e}")
-                            else:
-                                links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                                msg = f"📋 **{g['home']} – {g['away']}**\n\n❌ Tarkiblar API orqali e'lon qilinmagan.\n🔗 Quyidagi ishonchli saytlarda tarkiblarni ko‘ring:\n\n"
-                                for name, url in links[:4]:
-                                    msg += f"• [{name}]({url})\n"
-                                for u in g["users"]:
-                                    if not u["nl"]:
-                                        try:
-                                            await app.bot.send_message(u["id"], msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                            await update_notification_flags(u["id"], mid, lineups=True)
-                                        except Exception as e:
-                                            logger.error(f"Lineups notification error: {e}")
-                            g["nl_flag"] = True
-                if not g["n15_flag"] and any(not u["n15"] for u in g["users"]):
-                    if 10 <= delta <= 20:
-                        links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                        msg = f"⏳ **15 daqiqa qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n🔗 Jonli tarkiblar va statistika:\n\n"
-                        for name, url in links[:5]:
-                            msg += f"• [{name}]({url})\n"
-                        for u in g["users"]:
-                            if not u["n15"]:
-                                try:
-                                    await app.bot.send_message(u["id"], msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                    await update_notification_flags(u["id"], mid, fifteen_min=True)
-                                except Exception as e:
-                                    logger.error(f"15m notification error: {e}")
-                        g["n15_flag"] = True
+            fire_time, mid, kind = await notification_queue.next_due()
+            SCHEDULER_TICKS.inc(kind)
+            task = asyncio.create_task(_observed_notification(app, mid, kind, fire_time))
+            task.add_done_callback(_log_task_error)
         except Exception as e:
             logger.exception(f"Scheduler xatosi: {e}")
-        await asyncio.sleep(60)
+            await asyncio.sleep(1)
+
+def _log_task_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Fon vazifasi xatosi: {task.exception()!r}")
+
+# ========== LIVE TRACKER ==========
+LIVE_POLL_INTERVAL = int(os.environ.get("LIVE_POLL_INTERVAL", 30))
+LIVE_IDLE_INTERVAL = int(os.environ.get("LIVE_IDLE_INTERVAL", 300))
+LIVE_MATCH_WINDOW = 3 * 3600
+LIVE_SNAPSHOT_TTL = 6 * 3600
+FINAL_STATUSES = {"FINISHED", "AWARDED", "CANCELLED", "POSTPONED", "SUSPENDED"}
+
+live_snapshots = {}
+
+@observe_db
+async def get_live_watchlist():
+    """Obunachisi bor va hozir oʻynalayotgan (yoki boshlanay deb turgan) oʻyinlar."""
+    now = datetime.utcnow()
+    since = (now - timedelta(seconds=LIVE_MATCH_WINDOW)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    until = (now + timedelta(seconds=LIVE_POLL_INTERVAL)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    async with db_pool.reader() as db:
+        async with db.execute("SELECT DISTINCT match_id FROM subscriptions WHERE match_time BETWEEN ? AND ?",
+                              (since, until)) as cur:
+            return {r[0] for r in await cur.fetchall()}
+
+def live_snapshot(match):
+    full_time = (match.get("score") or {}).get("fullTime") or {}
+    return {"status": match.get("status"), "home": full_time.get("home") or 0, "away": full_time.get("away") or 0}
+
+def diff_live(prev, cur):
+    """Ikki snapshot orasidagi hodisalar: boshlanish, gollar, tanaffus, ikkinchi taym, yakun."""
+    events = []
+    prev = prev or {"status": "TIMED", "home": 0, "away": 0}
+    if prev["status"] == cur["status"]:
+        pass
+    elif prev["status"] not in LIVE_STATUSES | FINAL_STATUSES and cur["status"] in LIVE_STATUSES:
+        events.append(("started", None))
+    elif prev["status"] == "PAUSED" and cur["status"] == "IN_PLAY":
+        events.append(("second_half", None))
+    for side in ("home", "away"):
+        for _ in range(max(cur[side] - prev[side], 0)):
+            events.append(("goal", side))
+    if prev["status"] != cur["status"]:
+        if cur["status"] == "PAUSED":
+            events.append(("half_time", None))
+        elif cur["status"] in FINAL_STATUSES:
+            events.append(("full_time", cur["status"]))
+    return events
+
+LIVE_EVENT_LOG = 10
+
+LIVE_EVENT_TEXT = {
+    "started": "▶️ Oʻyin boshlandi",
+    "half_time": "⏸ Tanaffus",
+    "second_half": "▶️ Ikkinchi taym boshlandi",
+    "full_time": "🏁 Oʻyin yakunlandi",
+}
+
+def live_event_lines(match, snapshot, events):
+    home = match.get("homeTeam", {}).get("name", "Noma'lum")
+    away = match.get("awayTeam", {}).get("name", "Noma'lum")
+    lines = []
+    for kind, detail in events:
+        if kind == "goal":
+            lines.append(f"⚽ GOL! {home if detail == 'home' else away} ({snapshot['home']} – {snapshot['away']})")
+        elif kind == "full_time" and detail != "FINISHED":
+            lines.append(f"⚠️ Oʻyin toʻxtatildi ({MATCH_STATUS_TEXT.get(detail, detail)})")
+        else:
+            lines.append(LIVE_EVENT_TEXT[kind])
+    return lines
+
+def format_live_message(match, snapshot):
+    """Jonli tablo – har bir obunachida bitta xabar boʻlib, hodisalarda tahrirlanadi."""
+    home = match.get("homeTeam", {}).get("name", "Noma'lum")
+    away = match.get("awayTeam", {}).get("name", "Noma'lum")
+    events = "\n".join(f"• {line}" for line in snapshot.get("events", []))
+    return (
+        f"⚽ **JONLI HISOB**\n\n"
+        f"🏆 **{home}** 🆚 **{away}**\n"
+        f"🔢 **Hisob:** {snapshot['home']} – {snapshot['away']}\n"
+        f"📊 **Holat:** {MATCH_STATUS_TEXT.get(snapshot['status'], snapshot['status'])}\n\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n\n"
+        f"{events}\n\n"
+        f"🆔 **Match ID:** `{match['id']}`"
+    )
+
+async def _load_snapshot(match_id: int):
+    if match_id not in live_snapshots:
+        stored = await state_backend.cache_get(f"live:{match_id}")
+        live_snapshots[match_id] = stored["payload"] if stored else None
+    return live_snapshots[match_id]
+
+class LiveMessageStore:
+    """(match_id, chat_id) -> (message_id, content_hash): xotirada, oʻzgarishlar SQLite ga partiyalab yoziladi."""
+
+    def __init__(self):
+        self._data = {}
+        self._dirty = {}
+        self.stats = {"sent": 0, "edited": 0, "skipped": 0}
+
+    @observe_db
+    async def load(self, match_id: int):
+        if match_id in self._data:
+            return self._data[match_id]
+        async with db_pool.reader() as db:
+            async with db.execute("SELECT chat_id, message_id, content_hash FROM live_messages WHERE match_id = ?",
+                                  (match_id,)) as cur:
+                self._data[match_id] = {chat_id: (message_id, digest) for chat_id, message_id, digest in await cur.fetchall()}
+        return self._data[match_id]
+
+    def get(self, match_id: int, chat_id: int):
+        return self._data.get(match_id, {}).get(chat_id)
+
+    def reset(self):
+        """Lease boshqa workerga oʻtganda xotiradagi nusxa eskiradi – keyingi load() bazadan oʻqiydi."""
+        self._data.clear()
+
+    def set(self, match_id: int, chat_id: int, message_id: int, digest: str):
+        self._data.setdefault(match_id, {})[chat_id] = (message_id, digest)
+        self._dirty[(match_id, chat_id)] = (message_id, digest)
+
+    @observe_db
+    async def flush(self):
+        if not self._dirty:
+            return
+        rows, self._dirty = self._dirty, {}
+        now = time.time()
+        async with db_pool.writer() as db:
+            await db.executemany("INSERT OR REPLACE INTO live_messages VALUES (?, ?, ?, ?, ?)",
+                                 [(mid, chat_id, message_id, digest, now) for (mid, chat_id), (message_id, digest) in rows.items()])
+            await db.commit()
+
+    @observe_db
+    async def drop(self, match_id: int):
+        """Oʻyin tugagach tablo endi tahrirlanmaydi."""
+        self._data.pop(match_id, None)
+        self._dirty = {k: v for k, v in self._dirty.items() if k[0] != match_id}
+        async with db_pool.writer() as db:
+            await db.execute("DELETE FROM live_messages WHERE match_id = ?", (match_id,))
+            await db.commit()
+
+live_messages = LiveMessageStore()
+
+def live_deliverer(match_id: int, digest: str):
+    """Obunachidagi tablo xabarini tahrirlaydi; xabar yoʻq yoki tahrirlab boʻlmasa yangisini yuboradi."""
+
+    async def deliver(bot, chat_id: int, messages) -> bool:
+        kwargs = messages[0]
+        known = live_messages.get(match_id, chat_id)
+        if known and known[1] == digest:
+            live_messages.stats["skipped"] += 1
+            return True
+        if known:
+            try:
+                await _telegram_call(lambda: bot.edit_message_text(chat_id=chat_id, message_id=known[0], **kwargs))
+                live_messages.stats["edited"] += 1
+                live_messages.set(match_id, chat_id, known[0], digest)
+                return True
+            except BadRequest as e:
+                if is_not_modified(e):
+                    live_messages.stats["skipped"] += 1
+                    live_messages.set(match_id, chat_id, known[0], digest)
+                    return True
+                # Xabar oʻchirilgan yoki juda eski – yangisi yuboriladi
+            except Exception as e:
+                logger.error(f"Jonli xabar tahrirlanmadi (user {chat_id}): {e}")
+                return False
+        try:
+            sent = await _telegram_call(lambda: bot.send_message(chat_id, **kwargs))
+        except Exception as e:
+            logger.error(f"Jonli xabar yuborilmadi (user {chat_id}): {e}")
+            return False
+        live_messages.stats["sent"] += 1
+        live_messages.set(match_id, chat_id, sent.message_id, digest)
+        return True
+
+    return deliver
+
+async def push_live_update(bot, match, snapshot):
+    mid = match["id"]
+    subscribers = await get_subscribers_for_match(mid)
+    if not subscribers:
+        return
+    text = format_live_message(match, snapshot)
+    await live_messages.load(mid)
+    await broadcast(bot, subscribers, [{"text": text, "parse_mode": "Markdown"}], label=f"live:{mid}",
+                    deliver=live_deliverer(mid, content_hash(text)))
+    if snapshot["status"] in FINAL_STATUSES:
+        await live_messages.drop(mid)
+    else:
+        await live_messages.flush()
+
+_live_pending = {}
+
+def schedule_live_push(bot, match, snapshot):
+    """Bir oʻyin uchun bir vaqtda bitta yuborish; orada kelgan yangilanishlardan faqat oxirgisi yuboriladi."""
+    mid = match["id"]
+    running = mid in _live_pending
+    _live_pending[mid] = (match, snapshot)
+    if running:
+        return
+
+    async def _run():
+        try:
+            while True:
+                pending = _live_pending[mid]
+                await push_live_update(bot, *pending)
+                if _live_pending[mid] is pending:
+                    break
+        finally:
+            del _live_pending[mid]
+
+    asyncio.create_task(_run()).add_done_callback(_log_task_error)
+
+async def poll_live_matches(bot) -> int:
+    """Bitta umumiy soʻrov bilan jonli oʻyinlarni yangilaydi; keyingi soʻrovgacha kutish (s) qaytaradi."""
+    watchlist = await get_live_watchlist()
+    for mid in list(live_snapshots):
+        if mid not in watchlist:
+            del live_snapshots[mid]
+    pending = [mid for mid in watchlist if ((await _load_snapshot(mid)) or {}).get("status") not in FINAL_STATUSES]
+    if not pending:
+        return LIVE_IDLE_INTERVAL
+    url = f"{FOOTBALL_DATA_URL}/matches"
+    res = await rate_limited_api_call(url, HEADERS, {"competitions": ",".join(TOP_LEAGUES), "status": "LIVE,IN_PLAY,PAUSED"},
+                                      PRIORITY_BACKGROUND)
+    if "success" not in res:
+        logger.warning(f"Jonli oʻyinlarni olib boʻlmadi: {res.get('error')}")
+        return LIVE_POLL_INTERVAL
+    matches = {m["id"]: m for m in res["success"].get("matches", []) if m["id"] in watchlist}
+    # Roʻyxatdan chiqib ketgan (tugagan) oʻyinlarning yakuniy holati ids= bilan bitta soʻrovda olinadi
+    gone = [mid for mid, snap in live_snapshots.items()
+            if mid in watchlist and mid not in matches and snap and snap["status"] in LIVE_STATUSES]
+    if gone:
+        res = await rate_limited_api_call(url, HEADERS, {"ids": ",".join(map(str, sorted(gone)))}, PRIORITY_BACKGROUND)
+        for m in res.get("success", {}).get("matches", []):
+            matches[m["id"]] = m
+    for mid, match in matches.items():
+        cached = match_cache.get(mid, count=False)
+        if cached is None or not has_full_details(cached):
+            match_cache.set(mid, match, match_ttl(match))
+        snapshot = live_snapshot(match)
+        prev = await _load_snapshot(mid)
+        if prev and all(prev[k] == snapshot[k] for k in ("status", "home", "away")):
+            continue
+        events = diff_live(prev, snapshot)
+        snapshot["events"] = ((prev or {}).get("events", []) + live_event_lines(match, snapshot, events))[-LIVE_EVENT_LOG:]
+        live_snapshots[mid] = snapshot
+        await state_backend.cache_set(f"live:{mid}", snapshot, LIVE_SNAPSHOT_TTL)
+        if events:
+            logger.info(f"Jonli hodisa: match {mid}, {[kind for kind, _ in events]}")
+            schedule_live_push(bot, match, snapshot)
+    return LIVE_POLL_INTERVAL
+
+async def live_tracker(bot):
+    """Jonli kuzatuvni faqat "live" lease egasi bajaradi."""
+    while True:
+        interval = LIVE_POLL_INTERVAL
+        try:
+            if await state_backend.acquire_lease(db_scoped("live"), LIVE_IDLE_INTERVAL + LIVE_POLL_INTERVAL):
+                SCHEDULER_TICKS.inc("live_poll")
+                interval = await poll_live_matches(bot)
+            else:
+                # Boshqa worker kuzatmoqda – qaytib lease olsak snapshotlar umumiy keshdan oʻqiladi
+                live_snapshots.clear()
+                live_messages.reset()
+        except Exception as e:
+            logger.exception(f"Jonli kuzatuv xatosi: {e}")
+        await asyncio.sleep(interval)
 
 # ========== ADMIN BUYRUQLARI ==========
 async def add_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     if len(context.args) < 2:
@@ -823,23 +2769,17 @@ async def add_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(f"✅ Tahlil matni qoʻshildi (Match ID: {match_id}).")
     subs = await get_subscribers_for_match(match_id)
     if subs:
-        sent = 0
         safe_text = escape_markdown(text, version=2)
         buttons = [[InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")]]
         keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"Tahlil bildirishnomasi xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+        await update.message.reply_text(f"📤 {len(subs)} ta obunachiga bildirishnoma yuborilmoqda...")
+        broadcast_in_background(context.bot, subs, [{
+            "text": f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
+            "parse_mode": "Markdown", "reply_markup": keyboard}], admin_id=u.id, label=f"analysis:{match_id}")
 
 async def add_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     if len(context.args) != 2:
@@ -861,7 +2801,6 @@ async def add_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"✅ Toʻliq tahlil havolasi qoʻshildi (Match ID: {match_id}).\n🔗 {url}")
     subs = await get_subscribers_for_match(match_id)
     if subs:
-        sent = 0
         analysis_row = await get_analysis(match_id)
         analysis_text = analysis_row[0] if analysis_row else "Tahlil kutilmoqda"
         safe_text = escape_markdown(analysis_text, version=2)
@@ -870,20 +2809,15 @@ async def add_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
         ]
         keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"🔗 **Oʻyin uchun toʻliq tahlil havolasi qoʻshildi!**\n\n"
+        await update.message.reply_text(f"📤 {len(subs)} ta obunachiga bildirishnoma yuborilmoqda...")
+        broadcast_in_background(context.bot, subs, [{
+            "text": f"🔗 **Oʻyin uchun toʻliq tahlil havolasi qoʻshildi!**\n\n"
                     f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"URL bildirishnomasi xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+            "parse_mode": "Markdown", "reply_markup": keyboard}], admin_id=u.id, label=f"url:{match_id}")
 
 async def add_full_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     if len(context.args) < 3:
@@ -909,27 +2843,21 @@ async def add_full_analysis_command(update: Update, context: ContextTypes.DEFAUL
     await update.message.reply_text(f"✅ Tahlil va havola qoʻshildi (Match ID: {match_id}).\n🔗 {url}")
     subs = await get_subscribers_for_match(match_id)
     if subs:
-        sent = 0
         safe_text = escape_markdown(text, version=2)
         buttons = [
             [InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")],
             [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
         ]
         keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"📝 **Oʻyin tahlili va toʻliq tahlil havolasi qoʻshildi!**\n\n"
+        await update.message.reply_text(f"📤 {len(subs)} ta obunachiga bildirishnoma yuborilmoqda...")
+        broadcast_in_background(context.bot, subs, [{
+            "text": f"📝 **Oʻyin tahlili va toʻliq tahlil havolasi qoʻshildi!**\n\n"
                     f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"Bildirishnoma xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+            "parse_mode": "Markdown", "reply_markup": keyboard}], admin_id=u.id, label=f"full:{match_id}")
 
 async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     if len(context.args) != 1:
@@ -940,7 +2868,7 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("❌ ID raqam boʻlishi kerak.")
         return
-    if await is_admin(new):
+    if is_admin(new):
         await update.message.reply_text("⚠️ Bu foydalanuvchi allaqachon admin.")
         return
     if await add_admin(new, u.id):
@@ -950,7 +2878,7 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     if len(context.args) != 1:
@@ -961,10 +2889,10 @@ async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
     except ValueError:
         await update.message.reply_text("❌ ID raqam boʻlishi kerak.")
         return
-    if aid == 6935090105:
+    if aid in MAIN_ADMINS:
         await update.message.reply_text("❌ Asosiy adminni o‘chirib bo‘lmaydi.")
         return
-    if not await is_admin(aid):
+    if not is_admin(aid):
         await update.message.reply_text("⚠️ Bu foydalanuvchi admin emas.")
         return
     await remove_admin(aid)
@@ -972,7 +2900,7 @@ async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def list_admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
     admins = await get_all_admins()
@@ -987,21 +2915,14 @@ async def list_admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
+    if not is_admin(u.id):
         await update.message.reply_text("❌ Siz admin emassiz.")
         return
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM users") as cur:
-            users = (await cur.fetchone())[0]
-        async with db.execute("SELECT COUNT(*) FROM referrals") as cur:
-            refs = (await cur.fetchone())[0]
-        async with db.execute("SELECT SUM(balance) FROM users") as cur:
-            bal = (await cur.fetchone())[0] or 0
-        async with db.execute("SELECT COUNT(*) FROM withdrawals WHERE status='completed'") as cur:
-            wd_cnt = (await cur.fetchone())[0]
-        async with db.execute("SELECT SUM(amount) FROM withdrawals WHERE status='completed'") as cur:
-            wd_sum = (await cur.fetchone())[0] or 0
+    users, refs, bal, wd_cnt, wd_sum = await get_bot_stats()
     text = f"📊 **Bot statistikasi**\n\n👥 Foydalanuvchilar: {users}\n🔗 Referallar: {refs}\n💰 Jami balans: {bal:,} soʻm\n💸 Yechimlar soni: {wd_cnt}\n💵 Jami yechilgan: {wd_sum:,} soʻm"
+    timings = match_detail_timings.snapshot()
+    if "total" in timings:
+        text += "\n\n⏱ Oʻyin sahifasi (p95, ms): " + ", ".join(f"{k} {v['p95_ms']}" for k, v in timings.items())
     await update.message.reply_text(text, parse_mode="Markdown")
 
 async def test_api(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1014,15 +2935,86 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📊 Debug buyrug'i.")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Quyidagi chempionatlardan birini tanlang:", reply_markup=get_leagues_keyboard())
+    await update.message.reply_text("Quyidagi chempionatlardan birini tanlang:", reply_markup=LEAGUES_KEYBOARD)
+
+# ========== WEBHOOK ==========
+# WEBHOOK_URL berilsa long polling oʻrniga webhook rejimi yoqiladi (masalan https://bot.example.com)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# WEBHOOK_URL bilan majburiy; bir nechta nusxa bitta load balancer ortida ishlasa, hammasida bir xil boʻladi
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+# 0 – Telegram'da setWebhook chaqirilmaydi (lokal test: yozib olingan update'larni POST qilish)
+WEBHOOK_REGISTER = os.environ.get("WEBHOOK_REGISTER", "1") == "1"
+# setWebhook ni bir vaqtda ishga tushgan workerlardan faqat "webhook" lease egasi chaqiradi
+WEBHOOK_LEASE_TTL = 300
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 32))
+
+telegram_app = None
+
+async def telegram_webhook(request):
+    """Telegram update'ini qabul qilib, Application navbatiga qoʻyadi."""
+    if telegram_app is None:
+        # Bot hali ishga tushmagan – Telegram keyinroq qayta yuboradi
+        return web.Response(status=503)
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    # str bilan ASCII boʻlmagan header TypeError beradi – baytlar solishtiriladi
+    if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        logger.warning(f"Webhook: notoʻgʻri secret token ({request.remote})")
+        return web.Response(status=403)
+    try:
+        update = Update.de_json(await request.json(), telegram_app.bot)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logger.warning(f"Webhook: notoʻgʻri update: {e}")
+        return web.Response(status=400)
+    await telegram_app.update_queue.put(update)
+    return web.Response()
 
 # ========== WEB SERVER ==========
 async def health_check(request):
     return web.Response(text="✅ Bot ishlamoqda (Chiroyli tahlil + Italic)")
 
+@metrics.collector
+def collect_runtime_stats():
+    """Mavjud ichki statistikani (limiterlar, keshlar, navbatlar) gauge/counter sifatida beradi."""
+    lanes, tokens = [], []
+    for limiter_name, limiter in (("football-data", api_limiter), ("telegram", telegram_limiter)):
+        snap = limiter.snapshot()
+        tokens.append(({"limiter": limiter_name}, snap["tokens"]))
+        for lane, st in snap["lanes"].items():
+            lanes.append((limiter_name, lane, st))
+    caches = [("match", match_cache), ("render", render_cache), ("message_hash", message_hashes)]
+    return [
+        ("footbot_limiter_tokens", "gauge", "Limiterdagi mavjud tokenlar", tokens),
+        ("footbot_limiter_queue_depth", "gauge", "Token kutayotgan soʻrovlar",
+         [({"limiter": n, "lane": lane}, st["queue_depth"]) for n, lane, st in lanes]),
+        ("footbot_limiter_granted_total", "counter", "Berilgan tokenlar",
+         [({"limiter": n, "lane": lane}, st["granted"]) for n, lane, st in lanes]),
+        ("footbot_limiter_wait_max_seconds", "gauge", "Eng uzoq token kutish",
+         [({"limiter": n, "lane": lane}, st["wait_max"]) for n, lane, st in lanes]),
+        ("footbot_cache_events_total", "counter", "Kesh hodisalari (hits/misses/expired/evicted)",
+         [({"cache": name, "event": event}, cache.stats[event]) for name, cache in caches for event in cache.stats]
+         + [({"cache": "league", "event": event}, n) for event, n in league_cache_stats.items()]),
+        ("footbot_cache_entries", "gauge", "Keshdagi yozuvlar", [({"cache": name}, len(cache)) for name, cache in caches]),
+        ("footbot_cache_bytes", "gauge", "Keshning taxminiy hajmi", [({"cache": name}, cache.bytes) for name, cache in caches]),
+        ("footbot_singleflight_total", "counter", "Single-flight chaqiruvlari",
+         [({"role": role}, n) for role, n in api_flight.stats.items()]),
+        ("footbot_notification_queue", "gauge", "Rejalashtirilgan bildirishnoma hodisalari", [({}, len(notification_queue))]),
+        ("footbot_live_messages_total", "counter", "Jonli tablo yuborish/tahrirlash/oʻtkazib yuborish",
+         [({"result": k}, n) for k, n in live_messages.stats.items()]),
+        ("footbot_live_matches", "gauge", "Kuzatilayotgan jonli oʻyinlar", [({}, len(live_snapshots))]),
+    ]
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
 async def run_web_server():
     app = web.Application()
     app.router.add_get("/", health_check)
+    app.router.add_get("/metrics", metrics_handler)
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
     port = int(os.environ.get("PORT", 8080))
     runner = web.AppRunner(app)
     await runner.setup()
@@ -1031,12 +3023,15 @@ async def run_web_server():
 
 # ========== MAIN ==========
 async def run_bot():
+    global BOT_USERNAME, telegram_app
     token = os.environ.get("BOT_TOKEN")
     if not token:
         logger.error("BOT_TOKEN topilmadi!")
         return
+    await state_backend.open()
     await init_db()
-    app = Application.builder().token(token).build()
+    await start_http_session()
+    app = Application.builder().token(token).concurrent_updates(CONCURRENT_UPDATES).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("test", test_api))
     app.add_handler(CommandHandler("debug", debug))
@@ -1050,14 +3045,43 @@ async def run_bot():
     app.add_handler(CommandHandler("removeadmin", remove_admin_command))
     app.add_handler(CommandHandler("listadmins", list_admins_command))
     await app.initialize()
+    # BOT_USERNAME muhitda berilmasa initialize() dagi getMe natijasi ishlatiladi
+    BOT_USERNAME = BOT_USERNAME or app.bot.username
     await app.start()
-    await app.updater.start_polling()
-    logger.info("🤖 Bot ishga tushdi! (Chiroyli tahlil + Italic)")
+    if WEBHOOK_URL:
+        if WEBHOOK_REGISTER and await state_backend.acquire_lease("webhook", WEBHOOK_LEASE_TTL):
+            try:
+                await app.bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                          max_connections=WEBHOOK_MAX_CONNECTIONS)
+            finally:
+                # Lease faqat bir vaqtda chaqirishni cheklaydi – keyingi deploy yana roʻyxatdan oʻtkaza olishi kerak
+                await state_backend.release_lease("webhook")
+        elif WEBHOOK_REGISTER:
+            logger.info("Webhook boshqa worker tomonidan roʻyxatdan oʻtkazilmoqda")
+        telegram_app = app
+        logger.info(f"🤖 Bot webhook rejimida ishga tushdi: {WEBHOOK_PATH}")
+    else:
+        await app.updater.start_polling()
+        logger.info("🤖 Bot ishga tushdi! (Chiroyli tahlil + Italic)")
     asyncio.create_task(notification_scheduler(app))
-    while True:
-        await asyncio.sleep(3600)
+    asyncio.create_task(cache_sweeper())
+    asyncio.create_task(fixture_prefetcher())
+    asyncio.create_task(job_worker(app.bot))
+    asyncio.create_task(live_tracker(app.bot))
+    asyncio.create_task(admin_syncer())
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await flag_batcher.flush()
+        await close_http_session()
+        await state_backend.close()
+        await close_db()
 
 async def main():
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # Tasodifiy secret har bir worker uchun boshqacha boʻlib, bir-birining update'larini rad etardi
+        raise SystemExit("WEBHOOK_URL berilgan, lekin WEBHOOK_SECRET yoʻq")
     await asyncio.gather(run_web_server(), run_bot())
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def run_db(tmp_path, monkeypatch):
+    """Vaqtinchalik bazada (migratsiyalar bilan) coroutine bajaradi: run_db(lambda: ...)."""
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(bot, "state_backend", bot.LocalStateBackend())
+
+    def run(coro_fn):
+        async def _run():
+            await bot.init_db()
+            try:
+                return await coro_fn()
+            finally:
+                await bot.close_db()
+        return asyncio.run(_run())
+
+    return run
@@ -0,0 +1,114 @@
+"""Qaynoq soʻrovlar indeks orqali ishlashini tekshiradi: EXPLAIN QUERY PLAN da jadvalni toʻliq SCAN qilish
+boʻlmasligi va kutilgan indeks ishlatilishi kerak."""
+import re
+import sqlite3
+
+import pytest
+
+import bot
+
+HOT_TABLES = ("subscriptions", "referrals", "withdrawals", "jobs", "api_cache")
+FULL_SCAN = re.compile(r"\bSCAN (%s)\b" % "|".join(HOT_TABLES))
+DML = ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")
+MIGRATIONS = None  # init_db ichidagi migratsiya soʻrovlari
+
+
+async def _broadcast():
+    await bot.get_subscribers_for_match(1)
+
+
+async def _claim():
+    await bot.claim_subscribers(1, "notified_1h")
+
+
+async def _flag_flush():
+    batcher = bot.FlagBatcher(interval=3600)
+    batcher.add("notified_15m", 1, 10)
+    batcher.add("notified_15m", 1, 11)
+    await batcher.flush()
+
+
+async def _watchlist():
+    await bot.get_live_watchlist()
+
+
+async def _pending_notifications():
+    await bot.get_pending_notification_matches()
+
+
+async def _job_claim():
+    await bot.claim_jobs()
+
+
+async def _job_delay():
+    await bot.next_job_delay()
+
+
+async def _purge():
+    await bot.disk_cache_purge()
+
+
+async def _stats():
+    await bot.get_bot_stats()
+
+
+async def _referral_credit():
+    await bot.get_or_create_user(1)
+    await bot.get_or_create_user(2, referrer_id=1, referred_name="Ali")
+
+
+# nom -> (soʻrovni bajaruvchi, plan da boʻlishi kerak boʻlgan indekslar[, tekshiriladigan jadvallar])
+QUERIES = {
+    "broadcast": (_broadcast, {"idx_subscriptions_match"}),
+    "claim": (_claim, {"idx_subscriptions_match"}),
+    "flag_flush": (_flag_flush, {"sqlite_autoindex_subscriptions_1"}),
+    "watchlist": (_watchlist, {"idx_subscriptions_time"}),
+    "pending_notifications": (_pending_notifications, {"idx_subscriptions_time"}),
+    "job_claim": (_job_claim, {"idx_jobs_due"}),
+    "job_delay": (_job_delay, {"idx_jobs_due"}),
+    "purge": (_purge, {"idx_api_cache_expires"}),
+    "stats": (_stats, {"idx_withdrawals_status"}),
+    "referral_credit": (_referral_credit, set()),
+    # Migratsiyalarning qolganlari bir martalik – faqat referal hisoblagichlarini toʻldirish tekshiriladi
+    "referral_backfill": (MIGRATIONS, {"idx_referrals_referrer"}, ("referrals",)),
+}
+
+
+def _traced_statements(run_db, monkeypatch, step, tables=HOT_TABLES):
+    """step() (yoki step=None boʻlsa init_db migratsiyalari) bajargan va qaynoq jadvallarga tegadigan SQL."""
+    statements = []
+    connect = bot.DBPool._connect
+
+    async def traced_connect(self, read_only=False):
+        conn = await connect(self, read_only)
+        await conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(bot.DBPool, "_connect", traced_connect)
+    marker = []
+
+    async def traced():
+        marker.append(len(statements))
+        if step is not None:
+            await step()
+
+    run_db(traced)
+    statements = statements[:marker[0]] if step is None else statements[marker[0]:]
+    return [s for s in statements
+            if s.lstrip().upper().startswith(DML) and any(t in s for t in tables)
+            and "schema_version" not in s]
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_hot_query_uses_index(run_db, monkeypatch, name):
+    step, expected, *tables = QUERIES[name]
+    statements = _traced_statements(run_db, monkeypatch, step, *tables)
+    assert statements, f"{name}: soʻrov kuzatilmadi"
+    plans = []
+    with sqlite3.connect(bot.DB_PATH) as conn:
+        for sql in statements:
+            plan = " | ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            assert not FULL_SCAN.search(plan), f"{name}: {sql}\n  -> {plan}"
+            plans.append(plan)
+    for index in expected:
+        assert any(re.search(r"\b%s\b" % index, plan) for plan in plans), f"{name}: {index} ishlatilmadi\n  -> {plans}"
@@ -0,0 +1,69 @@
+"""TokenBucket lane lari va single-flight ustuvorligini koʻtarish."""
+import asyncio
+
+import bot
+
+
+async def _drained_bucket():
+    bucket = bot.TokenBucket(20, per=1.0, capacity=1)
+    await bucket.acquire()
+    return bucket
+
+
+def _grant_order(promote: bool):
+    async def scenario():
+        bucket = await _drained_bucket()
+        order = []
+        ticket = bot.PriorityTicket(bot.PRIORITY_BACKGROUND)
+
+        async def take(name, **kwargs):
+            await bucket.acquire(**kwargs)
+            order.append(name)
+
+        background = asyncio.create_task(take("shared", ticket=ticket))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(take("interactive", priority=bot.PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        if promote:
+            assert ticket.raise_to(bot.PRIORITY_INTERACTIVE)
+            assert bucket.snapshot()["lanes"]["interactive"]["queue_depth"] == 2
+        await asyncio.gather(background, interactive)
+        return order, bucket.snapshot()["lanes"]
+
+    return asyncio.run(scenario())
+
+
+def test_background_waiter_yields_to_interactive():
+    order, _ = _grant_order(promote=False)
+    assert order == ["interactive", "shared"]
+
+
+def test_promoted_waiter_keeps_its_place_in_the_interactive_lane():
+    order, lanes = _grant_order(promote=True)
+    assert order == ["shared", "interactive"]
+    assert lanes["interactive"]["granted"] == 3
+    assert lanes["background"]["queue_depth"] == 0
+
+
+def test_single_flight_follower_raises_leader_priority():
+    async def scenario():
+        flight = bot.SingleFlight()
+        seen = []
+        release = asyncio.Event()
+
+        async def request(ticket):
+            await release.wait()
+            seen.append(ticket.priority)
+            return "ok"
+
+        leader = asyncio.create_task(flight.do("match:1", request, bot.PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("match:1", request, bot.PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(leader, follower), seen, flight.stats
+
+    results, seen, stats = asyncio.run(scenario())
+    assert results == ["ok", "ok"]
+    assert seen == [bot.PRIORITY_INTERACTIVE]
+    assert stats == {"leaders": 1, "followers": 1, "promoted": 1}
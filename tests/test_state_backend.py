@@ -0,0 +1,129 @@
+"""RedisStateBackend ning Lua skriptlari (token-bucket, lease, vazifalar navbati) fakeredis ustida."""
+import asyncio
+import json
+
+import pytest
+
+import bot
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis da EVALSHA uchun
+
+
+def run_redis(monkeypatch, scenario, db_id="db1"):
+    """scenario(make_backend) ni umumiy fakeredis server bilan bajaradi; har bir backend alohida worker."""
+    monkeypatch.setattr(bot, "DB_ID", db_id)
+    server = fakeredis.FakeServer()
+
+    def make_backend():
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        return bot.RedisStateBackend("redis://test", prefix="test", client=client)
+
+    return asyncio.run(scenario(make_backend))
+
+
+def test_token_bucket_spends_capacity_then_waits(monkeypatch):
+    async def scenario(make_backend):
+        backend = make_backend()
+        key = [backend._key("tokens", "api")]
+        now = 1000.0
+        # rate 5/s, sigʻim 5: beshta token darhol, oltinchisi 0.2 s kutadi
+        waits = [float(await backend._take(keys=key, args=[5, 5, now])) for _ in range(6)]
+        refilled = float(await backend._take(keys=key, args=[5, 5, now + 0.4]))
+        return waits, refilled
+
+    waits, refilled = run_redis(monkeypatch, scenario)
+    assert waits[:5] == [0.0] * 5
+    assert waits[5] == pytest.approx(0.2)
+    assert refilled == 0.0
+
+
+def test_token_bucket_pause_blocks_every_worker(monkeypatch):
+    async def scenario(make_backend):
+        first, second = make_backend(), make_backend()
+        key = [first._key("tokens", "api")]
+        await first._pause(keys=key, args=[1000.0 + 30, 30])
+        during = float(await second._take(keys=key, args=[5, 5, 1000.0]))
+        after = float(await second._take(keys=key, args=[5, 5, 1031.0]))
+        return during, after
+
+    during, after = run_redis(monkeypatch, scenario)
+    assert during == pytest.approx(30)
+    assert after == 0.0
+
+
+def test_lease_has_single_owner(monkeypatch):
+    async def scenario(make_backend):
+        backend = make_backend()
+        results = []
+        monkeypatch.setattr(bot, "WORKER_ID", "a")
+        results.append(await backend.acquire_lease("live", 10))
+        monkeypatch.setattr(bot, "WORKER_ID", "b")
+        results.append(await backend.acquire_lease("live", 10))
+        await backend.release_lease("live")  # b egasi emas – hech narsa qilmaydi
+        results.append(await backend.acquire_lease("live", 10))
+        monkeypatch.setattr(bot, "WORKER_ID", "a")
+        results.append(await backend.acquire_lease("live", 10))  # egasi uzaytiradi
+        await backend.release_lease("live")
+        monkeypatch.setattr(bot, "WORKER_ID", "b")
+        results.append(await backend.acquire_lease("live", 10))
+        return results
+
+    assert run_redis(monkeypatch, scenario) == [True, False, False, True, True]
+
+
+def test_job_claim_and_finish(monkeypatch):
+    async def scenario(make_backend):
+        first, second = make_backend(), make_backend()
+        await first.enqueue_job("aisports_bonus", {"user_id": 1}, dedupe_key="1")
+        await second.enqueue_job("aisports_bonus", {"user_id": 1}, dedupe_key="1")
+        claimed = await first.claim_jobs()
+        claimed_again = await second.claim_jobs()
+        job_id, kind, payload, attempts = claimed[0]
+        await first.finish_job(job_id, kind, attempts, RuntimeError("tarmoq"))
+        due = await first.redis.zscore(first._job_keys[0], job_id)
+        retry_not_due = await second.claim_jobs()
+        await first.finish_job(job_id, kind, attempts)
+        left = await first.snapshot()
+        return claimed, claimed_again, due, retry_not_due, left
+
+    claimed, claimed_again, due, retry_not_due, left = run_redis(monkeypatch, scenario)
+    assert [(kind, json.loads(payload), attempts) for _, kind, payload, attempts in claimed] == \
+        [("aisports_bonus", {"user_id": 1}, 1)]
+    assert claimed_again == []
+    assert due > bot.time.time() + 30
+    assert retry_not_due == []
+    assert left["jobs"] == 0
+
+
+def test_job_dropped_after_max_attempts(monkeypatch):
+    async def scenario(make_backend):
+        backend = make_backend()
+        await backend.enqueue_job("referral_notification", {"referrer_id": 1})
+        job_id, kind, _, _ = (await backend.claim_jobs())[0]
+        await backend.finish_job(job_id, kind, bot.JOB_MAX_ATTEMPTS, RuntimeError("tarmoq"))
+        return await backend.snapshot()
+
+    assert run_redis(monkeypatch, scenario)["jobs"] == 0
+
+
+def test_job_queue_is_per_database(monkeypatch):
+    async def scenario(make_backend):
+        backend = make_backend()
+        await backend.enqueue_job("aisports_bonus", {"user_id": 1}, dedupe_key="1")
+        monkeypatch.setattr(bot, "DB_ID", "db2")
+        return await backend.claim_jobs()
+
+    assert run_redis(monkeypatch, scenario) == []
+
+
+def test_bonus_job_for_unknown_user_is_retried(run_db):
+    async def scenario():
+        await bot.state_backend.enqueue_job("aisports_bonus", {"user_id": 404}, dedupe_key="404")
+        job = (await bot.state_backend.claim_jobs())[0]
+        await bot._run_job(None, *job)
+        async with bot.db_pool.reader() as db:
+            async with db.execute("SELECT attempts, run_at > ? FROM jobs", (bot.time.time() + 30,)) as cur:
+                return await cur.fetchall()
+
+    assert run_db(scenario) == [(1, 1)]
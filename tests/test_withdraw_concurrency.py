@@ -0,0 +1,49 @@
+"""Bir vaqtda kelgan pul yechish soʻrovlaridan faqat bittasi oʻtishi kerak (kunlik limit va balans)."""
+import asyncio
+
+import bot
+
+PARALLEL_REQUESTS = 200
+POOLS = 4
+USER_ID = 42
+
+
+def test_parallel_withdrawals_only_one_succeeds(run_db):
+    start_balance = bot.MIN_WITHDRAW * 10
+
+    async def scenario():
+        await bot.get_or_create_user(USER_ID)
+        async with bot.db_pool.writer() as db:
+            await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (start_balance, USER_ID))
+            await db.commit()
+        # Bitta DBPool ning yozish qulfi soʻrovlarni oʻzi ketma-ket qiladi – alohida jarayonlarni taqlid qilish
+        # uchun har bir soʻrov mustaqil pullardan birining yozuvchi ulanishiga tushadi
+        main_pool = bot.db_pool
+        pools = [bot.DBPool(bot.DB_PATH, readers=1) for _ in range(POOLS)]
+        for pool in pools:
+            await pool.open()
+
+        async def withdraw_via(pool):
+            # register_withdraw db_pool ni birinchi toʻxtashdan oldin oladi – global shu vazifa uchun almashtiriladi
+            bot.db_pool = pool
+            return await bot.register_withdraw(USER_ID, bot.MIN_WITHDRAW)
+
+        try:
+            results = await asyncio.gather(*(withdraw_via(pools[i % POOLS]) for i in range(PARALLEL_REQUESTS)))
+        finally:
+            bot.db_pool = main_pool
+            for pool in pools:
+                await pool.close()
+        async with bot.db_pool.reader() as db:
+            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (USER_ID,)) as cur:
+                balance = (await cur.fetchone())[0]
+            async with db.execute("SELECT COUNT(*) FROM withdrawals WHERE user_id = ?", (USER_ID,)) as cur:
+                withdrawals = (await cur.fetchone())[0]
+        return results, balance, withdrawals
+
+    results, balance, withdrawals = run_db(scenario)
+    succeeded = [r for r in results if r[0]]
+    assert len(succeeded) == 1
+    assert succeeded[0][1] == start_balance - bot.MIN_WITHDRAW
+    assert balance == start_balance - bot.MIN_WITHDRAW
+    assert withdrawals == 1